@@ -1,19 +1,51 @@
 import os
 import sys
+import mmap
 import random
+import tempfile
+import argparse
 
 import numpy as np
 
 from utils import *
+import ttable
+import batch
+import bitslice
+import parallel
+import stream
+import gcm
+import keystream
+import threads
+import backends
+import seekable
+try:
+    import _aescore                                         # optional compiled core, see setup.py
+except ImportError:
+    _aescore = None
 
-Nk = 4                                                      # key length in words
-                                                            # each word is 4-byte
+Nk = 4                                                      # key length in words for AES-128
+                                                            # each word is 4-byte; KeySchedule.Nk follows len(key)
 Nb = 4                                                      # block size in words
-Nr = 10                                                     # ROUNDS
+Nr = 10                                                     # ROUNDS for AES-128, KeySchedule.Nr follows len(key)
 BLOCKSIZE = 16                                              # bytes
+CLI_BATCH = 1 << 24                                         # bytes handed to the engine at once by the command line
+INTO_CHUNK = 1 << 20                                        # bytes per step of encrypt_into/decrypt_into
+ENGINES = ('reference', 'ttable', 'numpy', 'bitslice', 'cython', 'auto')   # reference: utils.py round functions
+VECTOR = {'numpy': batch, 'bitslice': bitslice}            # engines working on whole arrays of independent blocks
+DEFAULT_ENGINE = 'auto'                                     # per call, see backends.py
 
 class AES():
-    def __init__(self):
+    def __init__(self, engine:str=None):
+        """
+        engine: one of ENGINES, DEFAULT_ENGINE if None; 'cython' falls back to 'reference' when _aescore is not built;
+                'auto' picks the engine of every cipher_mode/invcipher_mode call from the mode and size;
+                'bitslice' has no data dependent lookups, single blocks included, so its CBC encryption
+                (one block at a time) is much slower than the other engines
+        """
+        engine = engine or DEFAULT_ENGINE
+        assert engine in ENGINES
+        self.backend = engine
+        self.engine = self.choose('ECB', 'encrypt', BLOCKSIZE)
         self.key = None
         self.mode = None
         self.iv = None
@@ -23,6 +55,90 @@ class AES():
         self.ptblocks = None
         self.ctblocks = []
         self.ciphertext = ''
+        self.aad = b''                                      # GCM: additional authenticated data
+        self.keystream = None                               # CTR: optional keystream.KeystreamCache
+        self.nonce = None                                   # CTR: 8 bytes nonce of encrypt_into/decrypt_into
+        self.ks = None
+
+    @classmethod
+    def new(cls, key, mode:str='CBC', engine:str=None):
+        """
+        hashlib style constructor, e.g. AES.new(key, 'CTR').encryptor()
+        """
+        aes = cls(engine=engine)
+        aes.key = key
+        aes.mode = mode
+        return aes
+
+    def choose(self, mode, op, size, engine=None):
+        """
+        the engine of one call: engine if given (per call override), else self.backend; 'auto' asks backends.select()
+        op: 'encrypt' or 'decrypt'; size: bytes
+        """
+        engine = engine or self.backend
+        assert engine in ENGINES
+        if engine == 'auto':
+            engine = backends.select(mode, op, size)
+        if engine == 'cython' and _aescore is None:
+            engine = 'reference'
+        return engine
+
+    def encryptor(self):
+        """
+        streaming encryption in self.mode: update(chunk) returns cipher text of the complete blocks, finalize() pads
+        GCM: update(chunk) returns all the cipher text, finalize() the tag
+        """
+        self.engine = self.choose(self.mode, 'encrypt', backends.STREAM_SIZE)
+        if self.mode == 'GCM':
+            return gcm.Encryptor(self, aad=self.aad)
+        return stream.Encryptor(self)
+
+    def decryptor(self):
+        """
+        streaming decryption in self.mode: update(chunk) returns plain text of the complete blocks, finalize() unpads
+        GCM: finalize() checks the tag and raises ValueError on a mismatch
+        """
+        self.engine = self.choose(self.mode, 'decrypt', backends.STREAM_SIZE)
+        if self.mode == 'GCM':
+            return gcm.Decryptor(self, aad=self.aad)
+        return stream.Decryptor(self)
+
+    def decrypt_range(self, source, offset, length):
+        """
+        decrypt plain text bytes [offset, offset + length) of a CTR cipher text without touching the other blocks
+        source: the cipher text as bytes-like data, a binary file object or a path
+        """
+        return seekable.decrypt_range(self.keyschedule(), source, offset, length)
+
+    def reader(self, source):
+        """
+        seekable file object over the plain text of a CTR cipher text
+        """
+        return seekable.CTRReader(self.keyschedule(), source)
+
+    def keystream_cache(self, **kwargs):
+        """
+        precompute CTR keystream on a background thread for cipher_mode/invcipher_mode, see keystream.py
+        kwargs: capacity, eviction ('lru' or 'fifo'), fresh, segment_blocks
+        """
+        if self.keystream is not None:
+            self.keystream.close()
+        self.keystream = keystream.KeystreamCache(self, **kwargs).start()
+        return self.keystream
+
+    def keyschedule(self):
+        """
+        The expanded key of self.key; only looked up again when self.key changes
+        """
+        if self.ks is None or self.ks.key != self.key:
+            self.ks = get_key_schedule(self.key)
+        return self.ks
+
+    def core(self):
+        """
+        the compiled key schedule of self.key, cached with the KeySchedule
+        """
+        return self.keyschedule().derive('cython', lambda ks: _aescore.KeySchedule(ks.key))
 
     def IV(self):
         if not self.iv:
@@ -32,40 +148,7 @@ class AES():
         """
         pad plaintext according to PKCS#7
         """
-        ptlen = len(self.plaintext)
-        if ptlen > 0:
-            if ptlen % BLOCKSIZE == 0:
-                self.plaintext_padded = self.plaintext + chr(int(b'10', 16)).encode('utf-8') * 16
-            elif ptlen % 16 == 1:
-                self.plaintext_padded = self.plaintext + chr(int(b'0F', 16)).encode('utf-8') * 15
-            elif ptlen % 16 == 2:
-                self.plaintext_padded = self.plaintext + chr(int(b'0E', 16)).encode('utf-8') * 14
-            elif ptlen % 16 == 3:
-                self.plaintext_padded = self.plaintext + chr(int(b'0D', 16)).encode('utf-8') * 13
-            elif ptlen % 16 == 4:
-                self.plaintext_padded = self.plaintext + chr(int(b'0C', 16)).encode('utf-8') * 12
-            elif ptlen % 16 == 5:
-                self.plaintext_padded = self.plaintext + chr(int(b'0B', 16)).encode('utf-8') * 11
-            elif ptlen % 16 == 6:
-                self.plaintext_padded = self.plaintext + chr(int(b'0A', 16)).encode('utf-8') * 10
-            elif ptlen % 16 == 7:
-                self.plaintext_padded = self.plaintext + chr(int(b'09', 16)).encode('utf-8') * 9
-            elif ptlen % 16 == 8:
-                self.plaintext_padded = self.plaintext + chr(int(b'08', 16)).encode('utf-8') * 8
-            elif ptlen % 16 == 9:
-                self.plaintext_padded = self.plaintext + chr(int(b'07', 16)).encode('utf-8') * 7
-            elif ptlen % 16 == 10:
-                self.plaintext_padded = self.plaintext + chr(int(b'06', 16)).encode('utf-8') * 6
-            elif ptlen % 16 == 11:
-                self.plaintext_padded = self.plaintext + chr(int(b'05', 16)).encode('utf-8') * 5
-            elif ptlen % 16 == 12:
-                self.plaintext_padded = self.plaintext + chr(int(b'04', 16)).encode('utf-8') * 4
-            elif ptlen % 16 == 13:
-                self.plaintext_padded = self.plaintext + chr(int(b'03', 16)).encode('utf-8') * 3
-            elif ptlen % 16 == 14:
-                self.plaintext_padded = self.plaintext + chr(int(b'02', 16)).encode('utf-8') * 2
-            elif ptlen % 16 == 15:
-                self.plaintext_padded = self.plaintext + chr(int(b'01', 16)).encode('utf-8') * 1
+        self.plaintext_padded = pkcs7_pad(self.plaintext)       # always 1 to 16 bytes, b'' becomes a full block
         self.ptblocks = [self.plaintext_padded[i:i + 16] for i in range(0, len(self.plaintext_padded), 16)]
 
     def cipher(self):
@@ -75,98 +158,359 @@ class AES():
         Nr: ROUNDS
         key: encrypt key
         """
-        words = keyexpansion(self.key)                                # the original key before key expansion
-        keys = [words[i:i + 4] for i in range(0, len(words), 4)]      # key expansion
-        key = keys[0][0] + keys[0][1] + keys[0][2] + keys[0][3]       # first expanded key
-        state = addroundkey(block2state(self.ptblock), block2state(key))
-        for r in range(Nr):
-            state = subbytes(state)
-            state = shiftrows(state)
-            if r < (Nr - 1):
-                state = mixcolumns(state)
-            state = addroundkey(state, block2state(keys[r + 1][0] + keys[r + 1][1] + keys[r + 1][2] + keys[r + 1][3]))
-
-        return state
+        return block2state(self.encrypt_block(self.ptblock))
 
     def invcipher(self):
-        words = keyexpansion(self.key)                                # the original key before key expansion
-        keys = [words[i:i + 4] for i in range(0, len(words), 4)]      # key expansion
-        key = keys[Nr][0] + keys[Nr][1] + keys[Nr][2] + keys[Nr][3]       # first expanded key
-        state = addroundkey(block2state(self.ctblock), block2state(key))
-        for r in range(Nr, 0, -1):
-            state = invshiftrows(state)
-            state = invsubbytes(state)
-            state = addroundkey(state, block2state(keys[r - 1][0] + keys[r - 1][1] + keys[r - 1][2] + keys[r - 1][3]))
-            if r > 1:
-                state = invmixcolumns(state)
-        return state
-
-    def cipher_mode(self, mode:str='CBC'):
-        """
-        This method uses mode. CBC: Cipher Block Chaining; CTR: Counter
+        return block2state(self.decrypt_block(self.ctblock))
+
+    def encrypt_block(self, block):
+        """
+        encrypt one 16 bytes block with the selected engine
+        """
+        if self.engine == 'ttable':
+            return ttable.encrypt_block(block, self.keyschedule())
+        if self.engine in VECTOR:
+            return VECTOR[self.engine].encrypt_blocks(batch.as_blocks(block), self.keyschedule()).tobytes()
+        if self.engine == 'cython':
+            return self.core().encrypt_block(block)
+        return cipher_flat(block, self.keyschedule().round_keys)
+
+    def decrypt_block(self, block):
+        """
+        decrypt one 16 bytes block with the selected engine
+        """
+        if self.engine == 'ttable':
+            return ttable.decrypt_block(block, self.keyschedule())
+        if self.engine in VECTOR:
+            return VECTOR[self.engine].decrypt_blocks(batch.as_blocks(block), self.keyschedule()).tobytes()
+        if self.engine == 'cython':
+            return self.core().decrypt_block(block)
+        return invcipher_flat(block, self.keyschedule().round_keys)
+
+    def encrypt_blocks(self, data):
+        """
+        encrypt every 16 bytes block of data independently (ECB) with the selected engine
+        """
+        if self.engine in VECTOR:
+            return VECTOR[self.engine].ecb_encrypt(self.keyschedule(), data)
+        if self.engine == 'cython':
+            out = bytearray(len(data))
+            self.core().ecb_encrypt(data, out)
+            return bytes(out)
+        return b''.join([self.encrypt_block(data[i:i + 16]) for i in range(0, len(data), 16)])
+
+    def decrypt_blocks(self, data):
+        """
+        decrypt every 16 bytes block of data independently (ECB) with the selected engine
+        """
+        if self.engine in VECTOR:
+            return VECTOR[self.engine].ecb_decrypt(self.keyschedule(), data)
+        if self.engine == 'cython':
+            out = bytearray(len(data))
+            self.core().ecb_decrypt(data, out)
+            return bytes(out)
+        return b''.join([self.decrypt_block(data[i:i + 16]) for i in range(0, len(data), 16)])
+
+    def _ecb(self, src, dst, encrypt=True):
+        """
+        dst[:] = ECB encryption (or decryption) of src; block aligned buffers of the same length
+        """
+        if self.engine == 'cython':
+            (self.core().ecb_encrypt if encrypt else self.core().ecb_decrypt)(src, dst)
+        else:
+            dst[:] = (self.encrypt_blocks if encrypt else self.decrypt_blocks)(bytes(src))
+
+    def _ctr(self, nonce, start, src, dst):
+        """
+        dst[:] = src XOR the keystream from counter block start
+        """
+        if self.engine == 'cython':
+            self.core().ctr_xor(nonce, start, src, dst)
+        elif self.engine in VECTOR:
+            n = len(src) - len(src) % BLOCKSIZE
+            dst[:n] = VECTOR[self.engine].ctr_xor(self.keyschedule(), nonce, src[:n], start)
+            if n < len(src):
+                dst[n:] = xor_block(bytes(src[n:]), self.encrypt_block(nonce + (start + n // BLOCKSIZE).to_bytes(8, 'big')))
+        else:
+            counters = batch.counter_blocks(nonce, start, -(-len(src) // BLOCKSIZE)).tobytes()
+            dst[:] = xor_block(bytes(src), self.encrypt_blocks(counters))
+
+    def _cbc_encrypt(self, iv, src, dst):
+        """
+        dst[:] = CBC encryption of src chained from iv, block by block so src may be dst
+        return: the last cipher text block, the iv of what follows
+        """
+        if self.engine == 'cython':
+            self.core().cbc_encrypt(iv, src, dst)
+            return bytes(dst[-BLOCKSIZE:]) if len(src) else iv
+        block = iv
+        for i in range(0, len(src), BLOCKSIZE):
+            block = self.encrypt_block(xor_block(bytes(src[i:i + BLOCKSIZE]), block))
+            dst[i:i + BLOCKSIZE] = block
+        return block
+
+    def _cbc_decrypt(self, iv, src, dst):
+        """
+        dst[:] = CBC decryption of src chained from iv
+        """
+        if self.engine == 'cython':
+            self.core().cbc_decrypt(iv, src, dst)
+        elif self.engine in VECTOR:
+            dst[:] = VECTOR[self.engine].cbc_decrypt(self.keyschedule(), iv, src)
+        else:
+            dst[:] = batch.cbc_unchain(self.decrypt_blocks(bytes(src)), iv, src)
+
+    def encrypt_into(self, src, dst, counter:int=0):
+        """
+        encrypt the buffer src into the buffer dst (bytearray, memoryview, NumPy array, mmap, ...) in self.mode,
+        without padding and without an IV/nonce prefix: CBC chains from self.iv, CTR uses self.nonce and starts at
+        counter block counter (both are generated when missing); src may be dst
+        return: bytes written
+        """
+        return self._into(src, dst, True, counter)
+
+    def decrypt_into(self, src, dst, counter:int=0):
+        """
+        the inverse of encrypt_into() with the same self.iv or self.nonce; src may be dst
+        """
+        return self._into(src, dst, False, counter)
+
+    def _into(self, src, dst, encrypt, counter):
+        """
+        CBC, CTR or ECB from src to dst, INTO_CHUNK bytes at a time so the memory used does not grow with the payload
+        """
+        assert self.mode in ('CBC', 'CTR', 'ECB')
+        src, dst = memoryview(src).cast('B'), memoryview(dst).cast('B')
+        n = len(src)
+        assert not dst.readonly and len(dst) >= n
+        assert self.mode == 'CTR' or n % BLOCKSIZE == 0, 'CBC and ECB work on whole blocks'
+        self.engine = self.choose(self.mode, 'encrypt' if encrypt else 'decrypt', n)
+        if self.mode == 'CBC':
+            assert encrypt or self.iv, 'decryption needs self.iv'
+            self.IV()
+        elif self.mode == 'CTR':
+            assert encrypt or self.nonce, 'decryption needs self.nonce'
+            self.nonce = self.nonce or os.urandom(BLOCKSIZE // 2)
+        return self._run_into(src, dst, encrypt, counter)
+
+    def _run_into(self, src, dst, encrypt, counter, mode=None):
+        """
+        the chunk loop of _into() with self.engine, self.iv and self.nonce already set
+        """
+        mode = mode or self.mode
+        n = len(src)
+        prev = self.iv
+        for lo in range(0, n, INTO_CHUNK):
+            s, d = src[lo:lo + INTO_CHUNK], dst[lo:lo + INTO_CHUNK]
+            if mode == 'ECB':
+                self._ecb(s, d, encrypt)
+            elif mode == 'CTR':
+                self._ctr(self.nonce, counter + lo // BLOCKSIZE, s, d)
+            elif encrypt:
+                prev = self._cbc_encrypt(prev, s, d)
+            else:
+                last = bytes(s[-BLOCKSIZE:])                # s may be d
+                self._cbc_decrypt(prev, s, d)
+                prev = last
+        return n
+
+    def _threaded(self, fn, data, workers):
+        """
+        fn(lo, src, dst) on up to workers block aligned slices of data, on the shared thread pool (see threads.py);
+        every slice writes into its part of one preallocated output
+        """
+        self.keyschedule()                                  # built once, before the threads share it
+        if self.engine == 'cython':
+            self.core()
+        src = memoryview(data).cast('B')
+        out = bytearray(len(src))
+        dst = memoryview(out)
+        threads.run(lambda lo, hi: fn(lo, src[lo:hi], dst[lo:hi]), len(src), workers)
+        return bytes(out)
+
+    def cipher_mode(self, mode:str='CBC', processes:int=None, workers:int=None, engine:str=None):
+        """
+        This method uses mode. CBC: Cipher Block Chaining; CTR: Counter; ECB: Electronic Codebook
+        GCM: Galois/Counter Mode, encrypts and authenticates self.plaintext (unpadded) and self.aad
+        processes: run CTR on a pool of this many processes (see parallel.py)
+        workers: run CTR and ECB on this many threads (see threads.py)
+        engine: this call only, instead of the engine given to AES()
         in_: a block
         Nr: ROUNDS
         key: encrypt key
         """
+        self.engine = self.choose(mode, 'encrypt', len(self.plaintext), engine)
         self.ctblocks = []
         if mode == 'CBC':
             if not self.iv:
                 self.IV()
 
-            for i, byte16 in enumerate(self.ptblocks):
-                if i == 0:
-                    self.ptblock = b''.join([(byte16[j] ^ self.iv[j]).to_bytes(1,'big') for j in range(len(self.iv))])
-                else:
-                    self.ptblock = b''.join([(byte16[j] ^ self.ctblocks[i - 1][j]).to_bytes(1,'big') for j in range(len(self.ctblocks[i - 1]))])
-                state = self.cipher()
-                block = state2block(state)
-                self.ctblocks.append(block)
+            if self.engine == 'cython':
+                ct = bytearray(len(self.ptblocks) * BLOCKSIZE)
+                self.core().cbc_encrypt(self.iv, b''.join(self.ptblocks), ct)
+                self.ctblocks = [bytes(ct[i:i + 16]) for i in range(0, len(ct), 16)]
+            else:
+                block = self.iv
+                for byte16 in self.ptblocks:
+                    block = self.encrypt_block(xor_block(byte16, block))
+                    self.ctblocks.append(block)
             self.ciphertext = self.iv + b''.join(self.ctblocks)
 
         elif mode == 'CTR':
             nonce = random.randbytes(8)
-            for i, byte16 in enumerate(self.ptblocks):
-                self.ptblock = nonce + i.to_bytes(8, 'big')
-                block = state2block(self.cipher())
-                block = b''.join([(block[j] ^ byte16[j]).to_bytes(1,'big') for j in range(len(byte16))])
-                self.ctblocks.append(block)
+            if self.keystream is not None:
+                nonce, stream = self.keystream.take(len(self.ptblocks) * BLOCKSIZE)
+                ct = xor_block(b''.join(self.ptblocks), stream)
+                self.ctblocks = [ct[i:i + 16] for i in range(0, len(ct), 16)]
+            elif processes:
+                ct = parallel.ctr_xor(self.key, nonce, b''.join(self.ptblocks), processes=processes)
+                self.ctblocks = [ct[i:i + 16] for i in range(0, len(ct), 16)]
+            elif workers:
+                ct = self._threaded(lambda lo, src, dst: self._ctr(nonce, lo // BLOCKSIZE, src, dst), b''.join(self.ptblocks), workers)
+                self.ctblocks = [ct[i:i + 16] for i in range(0, len(ct), 16)]
+            elif self.engine in VECTOR:
+                ct = VECTOR[self.engine].ctr_xor(self.keyschedule(), nonce, b''.join(self.ptblocks))
+                self.ctblocks = [ct[i:i + 16] for i in range(0, len(ct), 16)]
+            elif self.engine == 'cython':
+                ct = bytearray(len(self.ptblocks) * BLOCKSIZE)
+                self.core().ctr_xor(nonce, 0, b''.join(self.ptblocks), ct)
+                self.ctblocks = [bytes(ct[i:i + 16]) for i in range(0, len(ct), 16)]
+            else:
+                for i, byte16 in enumerate(self.ptblocks):
+                    self.ctblocks.append(xor_block(byte16, self.encrypt_block(nonce + i.to_bytes(8, 'big'))))
 
             self.ciphertext = nonce + b''.join(self.ctblocks)
 
-    def invcipher_mode(self, mode:str='CBC'):
-        self.ptblocks = []
+        elif mode == 'ECB':
+            if workers:
+                ct = self._threaded(lambda lo, src, dst: self._ecb(src, dst), b''.join(self.ptblocks), workers)
+            else:
+                ct = self.encrypt_blocks(b''.join(self.ptblocks))
+            self.ctblocks = [ct[i:i + 16] for i in range(0, len(ct), 16)]
+
+            self.ciphertext = b''.join(self.ctblocks)
+
+        elif mode == 'GCM':
+            self.ciphertext = gcm.encrypt(self, self.plaintext, aad=self.aad)
+            ct = self.ciphertext[gcm.IVSIZE:-gcm.TAGSIZE]
+            self.ctblocks = [ct[i:i + 16] for i in range(0, len(ct), 16)]
+
+        else:
+            raise ValueError(f'unsupported mode {mode}')
+
+    def _last_block(self, mode, ct):
+        """
+        plain text of the last block of ct alone; CBC chains from self.iv, CTR uses self.nonce
+        """
+        n = len(ct) // BLOCKSIZE
         if mode == 'CBC':
-            self.iv = self.ciphertext[:BLOCKSIZE]
-
-            for i, byte16 in enumerate(self.ctblocks):
-                self.ctblock = byte16
-                state = self.invcipher()
-                block = state2block(state)
-                if i == 0:
-                    block = b''.join([(block[j] ^ self.iv[j]).to_bytes(1,'big') for j in range(len(block))])
-                else:
-                    block = b''.join([(block[j] ^ self.ctblocks[i - 1][j]).to_bytes(1,'big') for j in range(len(block))])
-                if i == len(self.ctblocks) - 1:
-                    block = cleanup_last_block(block) 
-                if block:
-                    self.ptblocks.append(block)
+            return xor_block(self.decrypt_block(ct[-BLOCKSIZE:]), ct[-2 * BLOCKSIZE:-BLOCKSIZE] if n > 1 else self.iv)
+        if mode == 'CTR':
+            return xor_block(ct[-BLOCKSIZE:], self.encrypt_block(self.nonce + (n - 1).to_bytes(8, 'big')))
+        return self.decrypt_block(ct[-BLOCKSIZE:])
 
-        elif mode == 'CTR':
-            nonce = self.ciphertext[:(BLOCKSIZE // 2)]
-            for i, byte16 in enumerate(self.ctblocks):
-                self.ptblock = nonce + i.to_bytes((BLOCKSIZE // 2), 'big')
-                block = state2block(self.cipher())
-                block = b''.join([(block[j] ^ byte16[j]).to_bytes(1,'big') for j in range(len(byte16))])
-                if i == len(self.ctblocks) - 1:
-                    block = cleanup_last_block(block) 
-                if block:
-                    self.ptblocks.append(block)
+    def invcipher_mode(self, mode:str='CBC', processes:int=None, workers:int=None, engine:str=None):
+        """
+        processes: run CTR on a pool of this many processes (see parallel.py)
+        workers: run CTR, ECB and CBC on this many threads (see threads.py)
+        engine: this call only, instead of the engine given to AES()
+        CBC, CTR, ECB: the last block is decrypted first, ValueError on bad padding before the other blocks are touched
+        GCM: decrypts self.ciphertext, raises ValueError when it or self.aad is not authentic
+        """
+        self.engine = self.choose(mode, 'decrypt', len(self.ciphertext), engine)
+        if mode in ('CBC', 'CTR', 'ECB'):
+            if mode == 'CBC':
+                self.iv = self.ciphertext[:BLOCKSIZE]
+            elif mode == 'CTR':
+                self.nonce = self.ciphertext[:(BLOCKSIZE // 2)]
+            ct = b''.join(self.ctblocks)
+            if not ct:
+                raise ValueError('empty cipher text: padded plain text is at least one block')
+            if len(ct) % BLOCKSIZE:
+                raise ValueError('cipher text is not a whole number of blocks')
+            last = self._last_block(mode, ct)
+            body = len(ct) - BLOCKSIZE
+            size = len(ct) - padding_length(last)
+            tail = last[:size - body]
 
-        self.plaintext = b''.join(self.ptblocks)
+            if mode == 'CTR' and self.keystream is not None:
+                plaintext = xor_block(ct[:body], self.keystream.lookup(self.nonce, body)) + tail
+            elif mode == 'CTR' and processes:
+                plaintext = parallel.ctr_xor(self.key, self.nonce, ct[:body], processes=processes) + tail
+            elif workers:
+                kernels = {
+                    'CBC': lambda lo, src, dst: self._cbc_decrypt(ct[lo - BLOCKSIZE:lo] if lo else self.iv, src, dst),
+                    'CTR': lambda lo, src, dst: self._ctr(self.nonce, lo // BLOCKSIZE, src, dst),
+                    'ECB': lambda lo, src, dst: self._ecb(src, dst, encrypt=False),
+                }
+                plaintext = self._threaded(kernels[mode], ct[:body], workers) + tail
+            else:
+                out = bytearray(size)                       # the only buffer as large as the payload
+                self._run_into(memoryview(ct)[:body], memoryview(out)[:body], False, 0, mode)
+                out[body:] = tail
+                plaintext = bytes(out)
 
+        elif mode == 'GCM':
+            plaintext = gcm.decrypt(self, self.ciphertext, aad=self.aad)
 
+        else:
+            raise ValueError(f'unsupported mode {mode}')
 
-if __name__ == '__main__':
+        self.plaintext = plaintext
+        self.ptblocks = [plaintext[i:i + 16] for i in range(0, len(plaintext), 16)]
+
+
+
+def read_key(path):
+    """
+    key file: the raw key bytes, or the key as hex text
+    """
+    with open(path, 'rb') as fin:
+        key = fin.read()
+    if len(key.strip()) in (32, 48, 64) and HEX.fullmatch(key.strip()):
+        key = bytes.fromhex(key.strip().decode())
+    return key
+
+def crypt_file(aes, src, dst, encrypt=True, batch_size=CLI_BATCH):
+    """
+    encrypt or decrypt file src into file dst through memory maps, batch_size bytes at a time
+    the output goes to a temporary file next to dst, renamed onto dst only once finalize() succeeded,
+    so a bad GCM tag, bad padding or truncated input leaves no (unauthenticated) plain text behind
+    return: bytes written to dst
+    """
+    context = aes.encryptor() if encrypt else aes.decryptor()
+    with open(src, 'rb') as fin:
+        size = os.fstat(fin.fileno()).st_size
+        if not size and not encrypt:
+            raise ValueError('empty cipher text')
+        outsize = size + 2 * BLOCKSIZE if encrypt else size      # room for the IV and the padding
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(dst)), prefix='.' + os.path.basename(dst) + '.')
+        try:
+            with open(fd, 'w+b') as fout:
+                fout.truncate(outsize)
+                written = 0
+                with mmap.mmap(fout.fileno(), outsize) as out:
+                    inp = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+                    try:
+                        with memoryview(inp) as view:               # released before inp is closed, also on errors
+                            for i in range(0, size, batch_size):
+                                data = context.update(view[i:i + batch_size])
+                                out[written:written + len(data)] = data
+                                written += len(data)
+                        data = context.finalize()
+                        out[written:written + len(data)] = data
+                        written += len(data)
+                    finally:
+                        if size:
+                            inp.close()
+                fout.truncate(written)
+            os.replace(tmp, dst)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+    return written
+
+def demo():
     with open("buddha.txt", "rb") as fin:
         text = fin.read()
     aes = AES()
@@ -187,3 +531,31 @@ if __name__ == '__main__':
     aes.invcipher_mode(mode='CTR')
     print(f"After invcipher(CTR): {aes.plaintext}")
 
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m AES', description='AES file encryption')
+    commands = parser.add_subparsers(dest='command', required=True)
+    for command in ('encrypt', 'decrypt'):
+        sub = commands.add_parser(command)
+        sub.add_argument('--mode', choices=stream.MODES + ('GCM',), default='CBC')
+        sub.add_argument('--key-file', required=True, help='raw key bytes or hex text')
+        sub.add_argument('--engine', choices=ENGINES, help='default: auto, see backends.py')
+        sub.add_argument('--batch-size', type=int, default=CLI_BATCH, help='bytes per batch')
+        sub.add_argument('input')
+        sub.add_argument('output')
+    commands.add_parser('demo', help='encrypt and decrypt buddha.txt')
+    commands.add_parser('calibrate', help=f'time the engines, store the fastest per mode and size in {backends.CACHE_FILE}')
+    args = parser.parse_args(argv)
+
+    if args.command == 'demo':
+        demo()
+        return 0
+    if args.command == 'calibrate':
+        backends.calibrate(log=print)
+        return 0
+    encrypt = args.command == 'encrypt'
+    aes = AES.new(read_key(args.key_file), args.mode, engine=args.engine)
+    crypt_file(aes, args.input, args.output, encrypt=encrypt, batch_size=args.batch_size)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
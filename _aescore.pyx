@@ -0,0 +1,216 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+Compiled core: the T-table cipher of ttable.py, the key schedule and the
+ECB/CBC/CTR loops over typed buffers, with the GIL released in the bulk loops.
+Build with `python setup.py build_ext --inplace`; AES.py falls back to the
+pure Python engines when this module is not built.
+"""
+from libc.stdint cimport uint8_t, uint32_t, uint64_t
+from libc.string cimport memcpy
+
+import ttable
+from utils import SBOX as _SBOX, ISBOX as _ISBOX, Rcon as _Rcon
+
+cdef uint8_t SBOX[256]
+cdef uint8_t ISBOX[256]
+cdef uint32_t TE0[256]
+cdef uint32_t TE1[256]
+cdef uint32_t TE2[256]
+cdef uint32_t TE3[256]
+cdef uint32_t TD0[256]
+cdef uint32_t TD1[256]
+cdef uint32_t TD2[256]
+cdef uint32_t TD3[256]
+
+for _i in range(256):
+    SBOX[_i] = _SBOX[_i]
+    ISBOX[_i] = _ISBOX[_i]
+    TE0[_i] = ttable.Te0[_i]
+    TE1[_i] = ttable.Te1[_i]
+    TE2[_i] = ttable.Te2[_i]
+    TE3[_i] = ttable.Te3[_i]
+    TD0[_i] = ttable.Td0[_i]
+    TD1[_i] = ttable.Td1[_i]
+    TD2[_i] = ttable.Td2[_i]
+    TD3[_i] = ttable.Td3[_i]
+
+cdef enum:
+    MAXWORDS = 60                                           # 4 * (Nr + 1) words for AES-256
+
+cdef struct schedule_t:
+    uint32_t ek[MAXWORDS]
+    uint32_t dk[MAXWORDS]
+    int nr
+
+cdef inline uint32_t load32(const uint8_t *p) noexcept nogil:
+    return (<uint32_t>p[0] << 24) | (<uint32_t>p[1] << 16) | (<uint32_t>p[2] << 8) | p[3]
+
+cdef inline void store32(uint8_t *p, uint32_t w) noexcept nogil:
+    p[0] = w >> 24
+    p[1] = (w >> 16) & 0xff
+    p[2] = (w >> 8) & 0xff
+    p[3] = w & 0xff
+
+cdef inline uint32_t subword(uint32_t w) noexcept nogil:
+    return (<uint32_t>SBOX[w >> 24] << 24) | (<uint32_t>SBOX[(w >> 16) & 0xff] << 16) | (<uint32_t>SBOX[(w >> 8) & 0xff] << 8) | SBOX[w & 0xff]
+
+cdef void encrypt(const schedule_t *ks, const uint8_t *inp, uint8_t *out) noexcept nogil:
+    cdef const uint32_t *rk = ks.ek
+    cdef uint32_t s0 = load32(inp) ^ rk[0]
+    cdef uint32_t s1 = load32(inp + 4) ^ rk[1]
+    cdef uint32_t s2 = load32(inp + 8) ^ rk[2]
+    cdef uint32_t s3 = load32(inp + 12) ^ rk[3]
+    cdef uint32_t t0, t1, t2, t3
+    cdef int r
+    for r in range(1, ks.nr):
+        rk += 4
+        t0 = TE0[s0 >> 24] ^ TE1[(s1 >> 16) & 0xff] ^ TE2[(s2 >> 8) & 0xff] ^ TE3[s3 & 0xff] ^ rk[0]
+        t1 = TE0[s1 >> 24] ^ TE1[(s2 >> 16) & 0xff] ^ TE2[(s3 >> 8) & 0xff] ^ TE3[s0 & 0xff] ^ rk[1]
+        t2 = TE0[s2 >> 24] ^ TE1[(s3 >> 16) & 0xff] ^ TE2[(s0 >> 8) & 0xff] ^ TE3[s1 & 0xff] ^ rk[2]
+        t3 = TE0[s3 >> 24] ^ TE1[(s0 >> 16) & 0xff] ^ TE2[(s1 >> 8) & 0xff] ^ TE3[s2 & 0xff] ^ rk[3]
+        s0, s1, s2, s3 = t0, t1, t2, t3
+    rk += 4
+    store32(out, ((<uint32_t>SBOX[s0 >> 24] << 24) | (<uint32_t>SBOX[(s1 >> 16) & 0xff] << 16) | (<uint32_t>SBOX[(s2 >> 8) & 0xff] << 8) | SBOX[s3 & 0xff]) ^ rk[0])
+    store32(out + 4, ((<uint32_t>SBOX[s1 >> 24] << 24) | (<uint32_t>SBOX[(s2 >> 16) & 0xff] << 16) | (<uint32_t>SBOX[(s3 >> 8) & 0xff] << 8) | SBOX[s0 & 0xff]) ^ rk[1])
+    store32(out + 8, ((<uint32_t>SBOX[s2 >> 24] << 24) | (<uint32_t>SBOX[(s3 >> 16) & 0xff] << 16) | (<uint32_t>SBOX[(s0 >> 8) & 0xff] << 8) | SBOX[s1 & 0xff]) ^ rk[2])
+    store32(out + 12, ((<uint32_t>SBOX[s3 >> 24] << 24) | (<uint32_t>SBOX[(s0 >> 16) & 0xff] << 16) | (<uint32_t>SBOX[(s1 >> 8) & 0xff] << 8) | SBOX[s2 & 0xff]) ^ rk[3])
+
+cdef void decrypt(const schedule_t *ks, const uint8_t *inp, uint8_t *out) noexcept nogil:
+    cdef const uint32_t *rk = ks.dk
+    cdef uint32_t s0 = load32(inp) ^ rk[0]
+    cdef uint32_t s1 = load32(inp + 4) ^ rk[1]
+    cdef uint32_t s2 = load32(inp + 8) ^ rk[2]
+    cdef uint32_t s3 = load32(inp + 12) ^ rk[3]
+    cdef uint32_t t0, t1, t2, t3
+    cdef int r
+    for r in range(1, ks.nr):
+        rk += 4
+        t0 = TD0[s0 >> 24] ^ TD1[(s3 >> 16) & 0xff] ^ TD2[(s2 >> 8) & 0xff] ^ TD3[s1 & 0xff] ^ rk[0]
+        t1 = TD0[s1 >> 24] ^ TD1[(s0 >> 16) & 0xff] ^ TD2[(s3 >> 8) & 0xff] ^ TD3[s2 & 0xff] ^ rk[1]
+        t2 = TD0[s2 >> 24] ^ TD1[(s1 >> 16) & 0xff] ^ TD2[(s0 >> 8) & 0xff] ^ TD3[s3 & 0xff] ^ rk[2]
+        t3 = TD0[s3 >> 24] ^ TD1[(s2 >> 16) & 0xff] ^ TD2[(s1 >> 8) & 0xff] ^ TD3[s0 & 0xff] ^ rk[3]
+        s0, s1, s2, s3 = t0, t1, t2, t3
+    rk += 4
+    store32(out, ((<uint32_t>ISBOX[s0 >> 24] << 24) | (<uint32_t>ISBOX[(s3 >> 16) & 0xff] << 16) | (<uint32_t>ISBOX[(s2 >> 8) & 0xff] << 8) | ISBOX[s1 & 0xff]) ^ rk[0])
+    store32(out + 4, ((<uint32_t>ISBOX[s1 >> 24] << 24) | (<uint32_t>ISBOX[(s0 >> 16) & 0xff] << 16) | (<uint32_t>ISBOX[(s3 >> 8) & 0xff] << 8) | ISBOX[s2 & 0xff]) ^ rk[1])
+    store32(out + 8, ((<uint32_t>ISBOX[s2 >> 24] << 24) | (<uint32_t>ISBOX[(s1 >> 16) & 0xff] << 16) | (<uint32_t>ISBOX[(s0 >> 8) & 0xff] << 8) | ISBOX[s3 & 0xff]) ^ rk[2])
+    store32(out + 12, ((<uint32_t>ISBOX[s3 >> 24] << 24) | (<uint32_t>ISBOX[(s2 >> 16) & 0xff] << 16) | (<uint32_t>ISBOX[(s1 >> 8) & 0xff] << 8) | ISBOX[s0 & 0xff]) ^ rk[3])
+
+cdef class KeySchedule:
+    """
+    KeySchedule(key): FIPS-197 key expansion of a 16, 24 or 32 bytes key, and the
+    round keys of the equivalent inverse cipher
+    """
+    cdef schedule_t ks
+    cdef readonly bytes key
+
+    def __init__(self, key):
+        cdef const uint8_t[::1] k = key
+        cdef int nk = len(key) // 4
+        cdef int i, r, j, n
+        cdef uint32_t temp, w
+        assert len(key) in (16, 24, 32)
+        self.key = bytes(key)
+        self.ks.nr = nk + 6
+        n = 4 * (self.ks.nr + 1)
+        for i in range(nk):
+            self.ks.ek[i] = load32(&k[4 * i])
+        for i in range(nk, n):
+            temp = self.ks.ek[i - 1]
+            if i % nk == 0:
+                temp = subword((temp << 8) | (temp >> 24)) ^ (<uint32_t>_Rcon[i // nk] << 24)
+            elif nk > 6 and i % nk == 4:
+                temp = subword(temp)
+            self.ks.ek[i] = self.ks.ek[i - nk] ^ temp
+        for r in range(self.ks.nr + 1):
+            for j in range(4):
+                w = self.ks.ek[4 * (self.ks.nr - r) + j]
+                if 0 < r < self.ks.nr:
+                    w = TD0[SBOX[w >> 24]] ^ TD1[SBOX[(w >> 16) & 0xff]] ^ TD2[SBOX[(w >> 8) & 0xff]] ^ TD3[SBOX[w & 0xff]]
+                self.ks.dk[4 * r + j] = w
+
+    @property
+    def nr(self):
+        return self.ks.nr
+
+    def encrypt_block(self, const uint8_t[::1] block):
+        cdef uint8_t out[16]
+        assert block.shape[0] == 16
+        encrypt(&self.ks, &block[0], out)
+        return out[:16]
+
+    def decrypt_block(self, const uint8_t[::1] block):
+        cdef uint8_t out[16]
+        assert block.shape[0] == 16
+        decrypt(&self.ks, &block[0], out)
+        return out[:16]
+
+    def ecb_encrypt(self, const uint8_t[::1] src, uint8_t[::1] dst):
+        cdef Py_ssize_t i, n = src.shape[0]
+        assert n % 16 == 0 and dst.shape[0] >= n
+        with nogil:
+            for i in range(0, n, 16):
+                encrypt(&self.ks, &src[i], &dst[i])
+
+    def ecb_decrypt(self, const uint8_t[::1] src, uint8_t[::1] dst):
+        cdef Py_ssize_t i, n = src.shape[0]
+        assert n % 16 == 0 and dst.shape[0] >= n
+        with nogil:
+            for i in range(0, n, 16):
+                decrypt(&self.ks, &src[i], &dst[i])
+
+    def cbc_encrypt(self, const uint8_t[::1] iv, const uint8_t[::1] src, uint8_t[::1] dst):
+        """
+        dst = CBC encryption of src chained from iv; src may be dst
+        """
+        cdef Py_ssize_t i, n = src.shape[0]
+        cdef int j
+        cdef uint8_t block[16]
+        assert iv.shape[0] == 16 and n % 16 == 0 and dst.shape[0] >= n
+        memcpy(block, &iv[0], 16)
+        with nogil:
+            for i in range(0, n, 16):
+                for j in range(16):
+                    block[j] ^= src[i + j]
+                encrypt(&self.ks, block, block)
+                memcpy(&dst[i], block, 16)
+
+    def cbc_decrypt(self, const uint8_t[::1] iv, const uint8_t[::1] src, uint8_t[::1] dst):
+        """
+        dst = CBC decryption of src chained from iv; src may be dst
+        """
+        cdef Py_ssize_t i, n = src.shape[0]
+        cdef int j
+        cdef uint8_t prev[16]
+        cdef uint8_t cur[16]
+        cdef uint8_t block[16]
+        assert iv.shape[0] == 16 and n % 16 == 0 and dst.shape[0] >= n
+        memcpy(prev, &iv[0], 16)
+        with nogil:
+            for i in range(0, n, 16):
+                memcpy(cur, &src[i], 16)
+                decrypt(&self.ks, cur, block)
+                for j in range(16):
+                    dst[i + j] = block[j] ^ prev[j]
+                memcpy(prev, cur, 16)
+
+    def ctr_xor(self, const uint8_t[::1] nonce, uint64_t start, const uint8_t[::1] src, uint8_t[::1] dst):
+        """
+        dst = src XOR the keystream of the counter blocks nonce + i.to_bytes(8, 'big') from i = start; src may be dst
+        """
+        cdef Py_ssize_t i, n = src.shape[0]
+        cdef int j, m
+        cdef uint64_t c = start
+        cdef uint8_t counter[16]
+        cdef uint8_t stream[16]
+        assert nonce.shape[0] == 8 and dst.shape[0] >= n
+        memcpy(counter, &nonce[0], 8)
+        with nogil:
+            for i in range(0, n, 16):
+                store32(counter + 8, <uint32_t>(c >> 32))
+                store32(counter + 12, <uint32_t>c)
+                encrypt(&self.ks, counter, stream)
+                m = 16 if n - i >= 16 else <int>(n - i)
+                for j in range(m):
+                    dst[i + j] = src[i + j] ^ stream[j]
+                c += 1
@@ -0,0 +1,94 @@
+"""
+asyncio streams: encrypt or decrypt from an asyncio.StreamReader into an
+asyncio.StreamWriter without blocking the event loop.
+
+    await AsyncEncryptor(aes, reader, writer).run()
+
+Data is read chunk_size bytes at a time and handed to the incremental
+contexts of stream.py (or gcm.py), so the CBC previous block and the CTR
+counter carry over from one chunk to the next. Chunks of at least `offload`
+bytes run in an executor; writer.drain() after every chunk is the
+backpressure, so at most one chunk is in memory per connection.
+
+GCM decryption is the exception: no plain text reaches the writer before the
+tag is checked. It is held in memory until finalize() succeeds, up to
+max_held bytes; a longer message raises ValueError without writing anything.
+"""
+import asyncio
+
+CHUNK_SIZE = 1 << 20                                        # bytes read per batch
+OFFLOAD = 1 << 14                                           # smaller chunks are processed on the loop
+MAX_HELD = 1 << 26                                          # GCM plain text held back until the tag is checked
+
+class _AsyncContext():
+    def __init__(self, context, reader, writer, chunk_size:int=CHUNK_SIZE, executor=None, offload:int=OFFLOAD, hold:bool=False,
+                 max_held:int=MAX_HELD):
+        """
+        executor: concurrent.futures executor for the heavy chunks, the loop default if None
+        hold: keep all output until finalize() returned, at most max_held bytes
+        """
+        assert chunk_size > 0
+        self.context = context
+        self.hold = hold
+        self.max_held = max_held
+        self.reader = reader
+        self.writer = writer
+        self.chunk_size = chunk_size
+        self.executor = executor
+        self.offload = offload
+
+    async def _call(self, fn, *args, size=0):
+        if size < self.offload:
+            return fn(*args)
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def _write(self, data):
+        if data:
+            self.writer.write(data)
+            await self.writer.drain()
+        return len(data)
+
+    async def run(self):
+        """
+        process the reader until EOF, finalize
+        return: bytes written
+        """
+        written = 0
+        held, nheld = [], 0
+        while True:
+            chunk = await self.reader.read(self.chunk_size)
+            if not chunk:
+                break
+            data = await self._call(self.context.update, chunk, size=len(chunk))
+            if not self.hold:
+                written += await self._write(data)
+                continue
+            nheld += len(data)
+            if nheld > self.max_held:
+                raise ValueError(f'more than {self.max_held} bytes of unauthenticated plain text')
+            held.append(data)
+        final = self.context.finalize()                     # raises on a bad GCM tag, before anything held is written
+        return written + await self._write(b''.join(held) + final)
+
+class AsyncEncryptor(_AsyncContext):
+    def __init__(self, aes, reader, writer, **kwargs):
+        """
+        aes: AES with key and mode set, see AES.encryptor()
+        """
+        super().__init__(aes.encryptor(), reader, writer, **kwargs)
+
+class AsyncDecryptor(_AsyncContext):
+    def __init__(self, aes, reader, writer, **kwargs):
+        """
+        aes: AES with key and mode set, see AES.decryptor()
+        GCM: the plain text is written only once the tag checked out, run() raises ValueError on a bad tag
+             with nothing written, or on a message over max_held bytes
+        """
+        kwargs.setdefault('hold', aes.mode == 'GCM')
+        super().__init__(aes.decryptor(), reader, writer, **kwargs)
+
+async def encrypt_stream(aes, reader, writer, **kwargs):
+    return await AsyncEncryptor(aes, reader, writer, **kwargs).run()
+
+async def decrypt_stream(aes, reader, writer, **kwargs):
+    return await AsyncDecryptor(aes, reader, writer, **kwargs).run()
@@ -0,0 +1,100 @@
+"""
+Engine selection for AES(engine='auto'): the engine of every cipher_mode or
+invcipher_mode call is picked from the mode and the payload size.
+
+The choices come from a one-time calibration on this host,
+
+    python -m AES calibrate             # or backends.calibrate()
+
+which runs bench.py over a few sizes for every engine and writes the fastest
+engine per size to CACHE_FILE. Without it, defaults apply: the compiled core
+if it is built, else the T-tables for small messages and CBC encryption and
+NumPy for larger independent blocks.
+
+    choices: 'CBC-encrypt' -> [[max_size, engine], ..., [None, engine]]
+"""
+import os
+import json
+
+try:
+    import _aescore
+except ImportError:
+    _aescore = None
+
+CACHE_FILE = os.environ.get('AES_BACKENDS', os.path.join(os.path.expanduser('~'), '.cache', 'aes_backends.json'))
+CANDIDATES = ('reference', 'ttable', 'numpy', 'bitslice', 'cython')
+MODES = ('CBC', 'CTR', 'ECB')
+SIZES = (16, 1 << 8, 1 << 12, 1 << 16, 1 << 20)            # calibration payloads
+SMALL = 1 << 8                                              # default: T-tables up to this many bytes
+STREAM_SIZE = 1 << 20                                       # size assumed for streaming contexts
+VERSION = 1
+
+_choices = None
+
+def defaults():
+    if _aescore:
+        return {f'{mode}-{op}': [[None, 'cython']] for mode in MODES for op in ('encrypt', 'decrypt')}
+    choices = {f'{mode}-{op}': [[SMALL, 'ttable'], [None, 'numpy']] for mode in MODES for op in ('encrypt', 'decrypt')}
+    choices['CBC-encrypt'] = [[None, 'ttable']]
+    return choices
+
+def load(path=CACHE_FILE):
+    """
+    read the calibration in path, the defaults when it is missing, stale or names an engine that is not available
+    """
+    global _choices
+    _choices = defaults()
+    try:
+        with open(path) as fin:
+            table = json.load(fin)
+    except (OSError, ValueError):
+        return _choices
+    engines = {e for entries in table.get('choices', {}).values() for _, e in entries}
+    if table.get('version') == VERSION and engines <= set(CANDIDATES) and ('cython' not in engines or _aescore):
+        _choices.update(table['choices'])
+    return _choices
+
+def select(mode, op, size):
+    """
+    mode: CBC, CTR, ECB (GCM and other counter modes follow CTR); op: 'encrypt' or 'decrypt'; size: bytes
+    """
+    choices = _choices if _choices is not None else load()
+    entries = choices.get(f'{mode}-{op}') or choices[f'CTR-{op}']
+    for max_size, engine in entries:
+        if max_size is None or size <= max_size:
+            return engine
+    return entries[-1][1]
+
+def thresholds(results, name):
+    """
+    [[max_size, engine], ..., [None, engine]] from bench results: the fastest engine at every size, merged
+    """
+    best = {}
+    for r in results:
+        if r['name'] == name and (r['size'] not in best or r['seconds'] < best[r['size']]['seconds']):
+            best[r['size']] = r
+    entries = []
+    for size in sorted(best):
+        if entries and entries[-1][1] == best[size]['engine']:
+            entries[-1][0] = size
+        else:
+            entries.append([size, best[size]['engine']])
+    if entries:
+        entries[-1][0] = None
+    return entries
+
+def calibrate(path=CACHE_FILE, sizes=SIZES, engines=None, min_time=0.05, budget=1.0, log=None):
+    """
+    benchmark the engines on this host and write the choices to path
+    budget: seconds; an engine is not tried on bigger sizes once one call took longer
+    """
+    global _choices
+    import bench
+    engines = [e for e in (engines or CANDIDATES) if e != 'cython' or _aescore]
+    results = bench.run(sizes=sizes, engines=engines, modes=MODES, min_time=min_time, budget=budget, log=log)
+    choices = {f'{mode}-{op}': thresholds(results, f'{mode}-{op}') for mode in MODES for op in ('encrypt', 'decrypt')}
+    if os.path.dirname(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as fout:
+        json.dump({'version': VERSION, 'sizes': list(sizes), 'choices': choices}, fout, indent=1)
+    return load(path)
@@ -0,0 +1,312 @@
+"""
+NumPy batch engine: N blocks held as a (N, 16) uint8 array, byte i of a block at
+column i (state[r][c] is column 4 * c + r). Every step of a round is one array
+operation over all N blocks, so ECB and CTR cost ~10 array ops per round per batch.
+
+The round keys are a (Nr + 1, 16) array for one key, or a (N, Nr + 1, 16) array
+with one row of round keys per block (expand_keys()), in which case AddRoundKey
+is a per-row XOR and N blocks under N different keys cost the same ops.
+"""
+import os
+
+import numpy as np
+
+from utils import (
+    SBOX, ISBOX, GFP2, GFP3, GFP9, GFP11, GFP13, GFP14, Rcon, BLOCKSIZE, KEYSIZES,
+    get_key_schedule, pkcs7_pad, padding_length,
+)
+
+BATCH_BLOCKS = 1 << 16                                      # blocks per array op, bounds temporaries to ~1 MB
+
+SBOX_ = np.array(SBOX, dtype=np.uint8)
+ISBOX_ = np.array(ISBOX, dtype=np.uint8)
+GFP2_ = np.array(GFP2, dtype=np.uint8)
+GFP3_ = np.array(GFP3, dtype=np.uint8)
+GFP9_ = np.array(GFP9, dtype=np.uint8)
+GFP11_ = np.array(GFP11, dtype=np.uint8)
+GFP13_ = np.array(GFP13, dtype=np.uint8)
+GFP14_ = np.array(GFP14, dtype=np.uint8)
+
+# gather permutations over the 16 columns
+SHIFTROWS = np.array([4 * ((c + r) % 4) + r for c in range(4) for r in range(4)])
+INVSHIFTROWS = np.array([4 * ((c - r) % 4) + r for c in range(4) for r in range(4)])
+ROT1 = np.array([4 * c + (r + 1) % 4 for c in range(4) for r in range(4)])    # row r + 1 of the same column
+ROT2 = np.array([4 * c + (r + 2) % 4 for c in range(4) for r in range(4)])
+ROT3 = np.array([4 * c + (r + 3) % 4 for c in range(4) for r in range(4)])
+
+def round_keys(ks):
+    """
+    (Nr + 1, 16) uint8 array of the round keys of a utils.KeySchedule
+    """
+    return ks.derive('numpy', lambda ks: np.frombuffer(b''.join(ks.round_keys), dtype=np.uint8).reshape(-1, BLOCKSIZE))
+
+def as_blocks(data):
+    """
+    zero copy (N, 16) uint8 view of a bytes-like object whose length is a multiple of 16
+    """
+    assert len(data) % BLOCKSIZE == 0
+    return np.frombuffer(data, dtype=np.uint8).reshape(-1, BLOCKSIZE)
+
+def mixcolumns(s):
+    return GFP2_[s] ^ GFP3_[s[:, ROT1]] ^ s[:, ROT2] ^ s[:, ROT3]
+
+def invmixcolumns(s):
+    return GFP14_[s] ^ GFP11_[s[:, ROT1]] ^ GFP13_[s[:, ROT2]] ^ GFP9_[s[:, ROT3]]
+
+def expand_keys(keys):
+    """
+    keyexpansion() of K keys of one length in one pass, every step an array op over the K keys
+    keys: K bytes-like keys or a (K, 4 * Nk) uint8 array
+    return: (K, Nr + 1, 16) uint8 array, row k the round keys of key k
+    """
+    if not isinstance(keys, np.ndarray):
+        keys = [bytes(k) for k in keys]
+        assert len({len(k) for k in keys}) <= 1, 'expand_keys() takes keys of one length'
+        keys = np.frombuffer(b''.join(keys), dtype=np.uint8).reshape(len(keys), len(keys[0]) if keys else BLOCKSIZE)
+    assert keys.shape[1] in KEYSIZES, 'AES keys are 16, 24 or 32 bytes'
+    nk, nr = KEYSIZES[keys.shape[1]]
+    w = np.empty((len(keys), 4 * (nr + 1), 4), dtype=np.uint8)
+    w[:, :nk] = keys.reshape(-1, nk, 4)
+    for i in range(nk, 4 * (nr + 1)):
+        temp = w[:, i - 1]
+        if i % nk == 0:
+            temp = SBOX_[temp[:, [1, 2, 3, 0]]]             # SubWord(RotWord())
+            temp[:, 0] ^= Rcon[i // nk]
+        elif nk > 6 and i % nk == 4:
+            temp = SBOX_[temp]
+        w[:, i] = w[:, i - nk] ^ temp
+    return w.reshape(len(keys), nr + 1, BLOCKSIZE)
+
+def cipher(blocks, rk):
+    """
+    blocks: (N, 16) uint8 array of plain text
+    rk: (Nr + 1, 16) round keys, or (N, Nr + 1, 16) for a key per block
+    return: (N, 16) uint8 array of cipher text
+    """
+    nr = rk.shape[-2] - 1
+    s = blocks ^ rk[..., 0, :]
+    for r in range(1, nr):
+        s = SBOX_[s[:, SHIFTROWS]]                          # SubBytes and ShiftRows commute
+        s = mixcolumns(s)
+        s ^= rk[..., r, :]
+    s = SBOX_[s[:, SHIFTROWS]]
+    s ^= rk[..., nr, :]
+    return s
+
+def invcipher(blocks, rk):
+    """
+    blocks: (N, 16) uint8 array of cipher text
+    rk: (Nr + 1, 16) round keys, or (N, Nr + 1, 16) for a key per block
+    return: (N, 16) uint8 array of plain text
+    """
+    nr = rk.shape[-2] - 1
+    s = blocks ^ rk[..., nr, :]
+    for r in range(nr - 1, 0, -1):
+        s = ISBOX_[s[:, INVSHIFTROWS]]
+        s ^= rk[..., r, :]
+        s = invmixcolumns(s)
+    s = ISBOX_[s[:, INVSHIFTROWS]]
+    s ^= rk[..., 0, :]
+    return s
+
+def encrypt_blocks(blocks, ks):
+    """
+    blocks: (N, 16) uint8 array of plain text
+    return: (N, 16) uint8 array of cipher text
+    """
+    return cipher(blocks, round_keys(ks))
+
+def decrypt_blocks(blocks, ks):
+    """
+    blocks: (N, 16) uint8 array of cipher text
+    return: (N, 16) uint8 array of plain text
+    """
+    return invcipher(blocks, round_keys(ks))
+
+def counter_blocks(nonce, start, n):
+    """
+    (n, 16) uint8 array of CTR counter blocks nonce + i.to_bytes(8, 'big') for i in [start, start + n)
+    """
+    assert len(nonce) == BLOCKSIZE // 2
+    ctr = np.empty((n, BLOCKSIZE), dtype=np.uint8)
+    ctr[:, :BLOCKSIZE // 2] = np.frombuffer(nonce, dtype=np.uint8)
+    ctr[:, BLOCKSIZE // 2:] = np.arange(start, start + n, dtype='>u8').view(np.uint8).reshape(n, BLOCKSIZE // 2)
+    return ctr
+
+def ctr_keystream(ks, nonce, start, n, kernel=None):
+    """
+    keystream of the counter blocks start .. start + n - 1 as a (n, 16) uint8 array
+    kernel: the block encryption, encrypt_blocks by default (bitslice.encrypt_blocks)
+    """
+    return (kernel or encrypt_blocks)(counter_blocks(nonce, start, n), ks)
+
+def ecb_encrypt(ks, data, kernel=None):
+    kernel = kernel or encrypt_blocks
+    blocks = as_blocks(data)
+    return b''.join(kernel(blocks[i:i + BATCH_BLOCKS], ks).tobytes() for i in range(0, len(blocks), BATCH_BLOCKS))
+
+def ecb_decrypt(ks, data, kernel=None):
+    kernel = kernel or decrypt_blocks
+    blocks = as_blocks(data)
+    return b''.join(kernel(blocks[i:i + BATCH_BLOCKS], ks).tobytes() for i in range(0, len(blocks), BATCH_BLOCKS))
+
+def ctr_xor(ks, nonce, data, start=0, kernel=None):
+    """
+    CTR encryption and decryption: data XOR the keystream starting at counter block start
+    """
+    blocks = as_blocks(data)
+    out = []
+    for i in range(0, len(blocks), BATCH_BLOCKS):
+        chunk = blocks[i:i + BATCH_BLOCKS]
+        out.append((chunk ^ ctr_keystream(ks, nonce, start + i, len(chunk), kernel)).tobytes())
+    return b''.join(out)
+
+def _unchain(out, iv, blocks):
+    """
+    P_i = D(C_i) XOR C_{i - 1} in place, C_{-1} = iv
+    """
+    out[0] ^= np.frombuffer(iv, dtype=np.uint8)
+    out[1:] ^= blocks[:-1]
+    return out
+
+def cbc_unchain(decrypted, iv, data):
+    """
+    CBC decryption after the inverse cipher, as one XOR against the shifted cipher text
+    decrypted: D(C_i) of every block, data: the cipher text blocks C_i
+    """
+    out = np.frombuffer(decrypted, dtype=np.uint8).reshape(-1, BLOCKSIZE).copy()
+    return _unchain(out, iv, as_blocks(data)).tobytes()
+
+def cbc_decrypt(ks, iv, data, kernel=None):
+    """
+    CBC decryption does not chain: every block is decrypted at once, then XORed with the shifted cipher text
+    """
+    kernel = kernel or decrypt_blocks
+    blocks = as_blocks(data)
+    out = np.empty_like(blocks)
+    for i in range(0, len(blocks), BATCH_BLOCKS):
+        out[i:i + BATCH_BLOCKS] = kernel(blocks[i:i + BATCH_BLOCKS], ks)
+    return _unchain(out, iv, blocks).tobytes()
+
+def _rows(rk, idx):
+    """
+    the round keys of the blocks idx: rk itself when it is one key's
+    """
+    return rk if rk.ndim == 2 else rk[idx]
+
+def _step(rk):
+    """
+    blocks per array op, fewer with a key per block so the gathered round keys stay ~1 MB
+    """
+    return BATCH_BLOCKS if rk.ndim == 2 else max(BATCH_BLOCKS // rk.shape[1], 1)
+
+def _layout(bodies):
+    """
+    the messages as one (N, 16) block array
+    return: (flat, per message block counts, first blocks, owner message of every block)
+    """
+    nblocks = np.array([len(b) // BLOCKSIZE for b in bodies])
+    starts = np.concatenate(([0], np.cumsum(nblocks)[:-1]))
+    owner = np.repeat(np.arange(len(bodies)), nblocks)
+    return as_blocks(b''.join(bodies)), nblocks, starts, owner
+
+def _ctr_xor(rk, ivs, flat, starts, owner):
+    """
+    flat XOR the keystream of every message, counter 0 at its first block
+    """
+    nonces = np.frombuffer(b''.join(ivs), dtype=np.uint8).reshape(-1, BLOCKSIZE // 2)
+    counters = np.arange(len(flat)) - starts[owner]
+    out = np.empty_like(flat)
+    step = _step(rk)
+    for i in range(0, len(flat), step):
+        rows = owner[i:i + step]
+        ctr = np.empty((len(rows), BLOCKSIZE), dtype=np.uint8)
+        ctr[:, :BLOCKSIZE // 2] = nonces[rows]
+        ctr[:, BLOCKSIZE // 2:] = counters[i:i + step].astype('>u8').view(np.uint8).reshape(-1, BLOCKSIZE // 2)
+        out[i:i + step] = flat[i:i + step] ^ cipher(ctr, _rows(rk, rows))
+    return out
+
+def _encrypt_messages(rk, ivs, plaintexts, mode):
+    """
+    encrypt_many() and encrypt_multi(): rk is one key's round keys or a row per message
+    """
+    assert mode in ('CBC', 'CTR')
+    ivsize = BLOCKSIZE if mode == 'CBC' else BLOCKSIZE // 2
+    ivs = [iv if iv is not None else os.urandom(ivsize) for iv in ivs]
+    assert all(len(iv) == ivsize for iv in ivs)
+    padded = [pkcs7_pad(pt) for pt in plaintexts]
+    if not padded:
+        return []
+    flat, nblocks, starts, owner = _layout(padded)
+
+    if mode == 'CTR':
+        out = _ctr_xor(rk, ivs, flat, starts, owner)
+    else:
+        out = np.empty_like(flat)
+        order = np.argsort(-nblocks, kind='stable')
+        starts, nblocks = starts[order], nblocks[order]
+        rk = _rows(rk, order)
+        descending = -nblocks
+        prev = np.frombuffer(b''.join(ivs[i] for i in order), dtype=np.uint8).reshape(-1, BLOCKSIZE).copy()
+        for j in range(nblocks[0]):
+            active = int(np.searchsorted(descending, -j))          # messages longer than j blocks
+            idx = starts[:active] + j
+            prev[:active] = cipher(flat[idx] ^ prev[:active], rk if rk.ndim == 2 else rk[:active])
+            out[idx] = prev[:active]
+
+    ct = out.tobytes()
+    starts = np.concatenate(([0], np.cumsum([len(p) for p in padded])))
+    return [ivs[i] + ct[starts[i]:starts[i + 1]] for i in range(len(padded))]
+
+def encrypt_many(key, messages, mode='CBC'):
+    """
+    Encrypt many independent messages under one key, each with its own IV (CBC) or 8 bytes nonce (CTR).
+    CBC is serial within a message, so block j of every message still running is encrypted in one
+    batch per chain position; messages are sorted by length so the running ones are a prefix.
+    messages: [(iv, plaintext), ...], iv None for a random one
+    return: [iv + ciphertext, ...] in the layout of AES.cipher_mode(), plain text PKCS#7 padded
+    """
+    return _encrypt_messages(round_keys(get_key_schedule(key)), [iv for iv, _ in messages], [pt for _, pt in messages], mode)
+
+def encrypt_multi(keys, ivs, plaintexts, mode='CBC'):
+    """
+    Encrypt plaintexts[i] under keys[i] with ivs[i], all messages at once: the keys are expanded
+    together by expand_keys() and every round runs over the blocks of all messages, AddRoundKey
+    XORing each block with the round key of its own message. Same batching as encrypt_many().
+    keys: keys of one length, ivs: IVs (CBC) or 8 bytes nonces (CTR), None for a random one
+    return: [iv + ciphertext, ...] in the layout of AES.cipher_mode(), plain text PKCS#7 padded
+    """
+    assert len(keys) == len(ivs) == len(plaintexts)
+    return _encrypt_messages(expand_keys(keys), ivs, plaintexts, mode) if len(keys) else []
+
+def decrypt_multi(keys, ciphertexts, mode='CBC'):
+    """
+    Inverse of encrypt_multi(): ciphertexts[i] (iv + ciphertext) under keys[i]. CBC decryption does
+    not chain, so every block of every message goes through one invcipher() pass.
+    return: [plaintext, ...]; ValueError on a truncated message or bad padding
+    """
+    assert mode in ('CBC', 'CTR') and len(keys) == len(ciphertexts)
+    if not len(keys):
+        return []
+    ivsize = BLOCKSIZE if mode == 'CBC' else BLOCKSIZE // 2
+    ivs = [bytes(c[:ivsize]) for c in ciphertexts]
+    bodies = [bytes(c[ivsize:]) for c in ciphertexts]
+    if any(not b or len(b) % BLOCKSIZE for b in bodies):
+        raise ValueError('cipher text is not a whole number of blocks')
+    rk = expand_keys(keys)
+    flat, nblocks, starts, owner = _layout(bodies)
+
+    if mode == 'CTR':
+        out = _ctr_xor(rk, ivs, flat, starts, owner)
+    else:
+        prev = np.empty_like(flat)                          # C_{i - 1}, the IV before a message's first block
+        prev[1:] = flat[:-1]
+        prev[starts] = np.frombuffer(b''.join(ivs), dtype=np.uint8).reshape(-1, BLOCKSIZE)
+        out = np.empty_like(flat)
+        step = _step(rk)
+        for i in range(0, len(flat), step):
+            out[i:i + step] = invcipher(flat[i:i + step], rk[owner[i:i + step]]) ^ prev[i:i + step]
+
+    pt = out.tobytes()
+    ends = (starts + nblocks) * BLOCKSIZE
+    return [pt[lo:hi - padding_length(pt[hi - BLOCKSIZE:hi])] for lo, hi in zip(starts * BLOCKSIZE, ends)]
@@ -0,0 +1,157 @@
+"""
+Throughput and latency benchmarks for every engine and mode.
+
+    python bench.py                                   # default sizes, every engine
+    python bench.py --sizes 16,1K,1M,1G --engines numpy,cython --json run.json
+    python bench.py --baseline run.json --tolerance 0.2   # exit 1 on regressions
+
+Every result reports seconds per call, MB/s, ns per 16 bytes block and the
+peak memory allocated during one call (tracemalloc).
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+
+from AES import AES, ENGINES, _aescore
+from utils import BLOCKSIZE, keyexpansion
+
+SIZES = (16, 1 << 10, 1 << 16, 1 << 20)
+MODES = ('CBC', 'CTR')
+UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+def parse_size(text):
+    text = text.strip().upper().rstrip('B')
+    if text[-1:] in UNITS:
+        return int(text[:-1]) * UNITS[text[-1]]
+    return int(text)
+
+def measure(fn, min_time=0.2, max_repeat=1000):
+    """
+    best seconds per call of fn over repeated calls that take at least min_time in total
+    """
+    best, total, n = float('inf'), 0.0, 0
+    while (total < min_time or n < 1) and n < max_repeat:
+        t = time.perf_counter()
+        fn()
+        t = time.perf_counter() - t
+        best, total, n = min(best, t), total + t, n + 1
+    return best
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def record(name, engine, size, seconds, peak):
+    return {
+        'name': name,
+        'engine': engine,
+        'size': size,
+        'seconds': seconds,
+        'mb_s': size / seconds / 1e6 if size else None,
+        'ns_block': seconds * 1e9 / max(1, size // BLOCKSIZE),
+        'peak_bytes': peak,
+    }
+
+def bench_case(name, engine, size, fn, min_time):
+    return record(name, engine, size, measure(fn, min_time), peak_memory(fn))
+
+def run(sizes=SIZES, engines=None, modes=MODES, min_time=0.2, budget=10.0, log=None):
+    """
+    run every benchmark and return the list of results
+    budget: seconds; a mode/engine pair is skipped for bigger sizes once one call took longer
+    """
+    engines = [e for e in (engines or ENGINES) if e != 'cython' or _aescore]
+    key = os.urandom(16)
+    block = os.urandom(BLOCKSIZE)
+    results = []
+
+    def add(r):
+        results.append(r)
+        if log:
+            mb_s = f"{r['mb_s']:10.2f} MB/s" if r['mb_s'] else ' ' * 15
+            log(f"{r['name']:<14} {r['engine']:<10} {r['size']:>11} B {mb_s} {r['ns_block']:14.0f} ns/block {r['peak_bytes']:>12} B peak")
+
+    add(bench_case('keyexpansion', 'reference', 0, lambda: keyexpansion(key), min_time))
+    for engine in engines:
+        aes = AES.new(key, engine=engine)
+        aes.ptblock = aes.ctblock = block
+        add(bench_case('cipher', engine, BLOCKSIZE, aes.cipher, min_time))
+        add(bench_case('invcipher', engine, BLOCKSIZE, aes.invcipher, min_time))
+
+    for size in sizes:
+        aes = AES.new(key)
+        aes.plaintext = os.urandom(size)
+        add(bench_case('padding', 'reference', size, aes.padding, min_time))
+
+    for engine in engines:
+        for mode in modes:
+            slow = False
+            for size in sorted(sizes):
+                if slow:
+                    break
+                aes = AES.new(key, mode, engine=engine)
+                aes.plaintext = os.urandom(size)
+                aes.padding()
+
+                def encrypt():
+                    aes.cipher_mode(mode=mode)
+
+                def decrypt():
+                    aes.invcipher_mode(mode=mode)
+
+                encrypt()
+                for name, fn in ((f'{mode}-encrypt', encrypt), (f'{mode}-decrypt', decrypt)):
+                    r = bench_case(name, engine, size, fn, min_time)
+                    add(r)
+                    slow = slow or r['seconds'] > budget
+    return results
+
+def compare(results, baseline, tolerance=0.2):
+    """
+    results slower than the matching baseline result by more than tolerance
+    return: list of (result, baseline result)
+    """
+    index = {(r['name'], r['engine'], r['size']): r for r in baseline}
+    regressions = []
+    for r in results:
+        b = index.get((r['name'], r['engine'], r['size']))
+        if b and r['seconds'] > b['seconds'] * (1 + tolerance):
+            regressions.append((r, b))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='AES benchmarks')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in SIZES), help='message sizes, e.g. 16,1K,1M,1G')
+    parser.add_argument('--engines', default=','.join(ENGINES))
+    parser.add_argument('--modes', default=','.join(MODES))
+    parser.add_argument('--min-time', type=float, default=0.2, help='seconds of repeated calls per result')
+    parser.add_argument('--budget', type=float, default=10.0, help='skip bigger sizes after a call this slow')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--baseline', help='results of an earlier --json run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed slowdown against the baseline')
+    args = parser.parse_args(argv)
+
+    results = run(sizes=[parse_size(s) for s in args.sizes.split(',')], engines=args.engines.split(','),
+                  modes=args.modes.split(','), min_time=args.min_time, budget=args.budget, log=print)
+    if args.json:
+        with open(args.json, 'w') as fout:
+            json.dump({'python': sys.version, 'results': results}, fout, indent=1)
+    if args.baseline:
+        with open(args.baseline) as fin:
+            baseline = json.load(fin)['results']
+        regressions = compare(results, baseline, args.tolerance)
+        for r, b in regressions:
+            print(f"REGRESSION {r['name']} {r['engine']} {r['size']} B: {r['seconds']:.6f} s, baseline {b['seconds']:.6f} s")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,187 @@
+"""
+Bitsliced NumPy engine for the modes whose blocks are independent (ECB, CTR,
+CBC decryption). Bit b of byte p of 64 blocks is packed into one uint64 word,
+so a batch is a (16, 8, W) array of words. SubBytes is the 113 gate circuit of
+Boyar and Peralta (32 AND, 81 XOR/XNOR) and InvSubBytes the same circuit
+between two inverse affine maps; ShiftRows and MixColumns are word
+permutations and XORs. There are no data dependent table lookups or branches,
+single blocks included (AES.encrypt_block() packs them into one lane).
+"""
+import numpy as np
+
+import batch
+from utils import BLOCKSIZE
+
+ONES = np.uint64(0xffffffffffffffff)
+LANE_BLOCKS = 1 << 12                                       # blocks per circuit pass: 64 words per bit plane
+
+def pack(blocks):
+    """
+    (N, 16) uint8 blocks -> (16, 8, ceil(N / 64)) uint64 bit planes, block j in bit j % 64 of word j // 64
+    one contiguous packbits pass per bit, not a transpose of an (N, 16, 8) bit array
+    """
+    n = len(blocks)
+    w = -(-n // 64)
+    padded = np.zeros((w * 64, BLOCKSIZE), dtype=np.uint8)
+    padded[:n] = blocks
+    columns = np.ascontiguousarray(padded.T).reshape(BLOCKSIZE, w, 64)                     # byte p of every block
+    planes = np.empty((BLOCKSIZE, 8, w), dtype='<u8')
+    for i in range(8):
+        planes[:, i] = np.packbits((columns >> i) & 1, axis=2, bitorder='little').view('<u8').reshape(BLOCKSIZE, w)
+    return planes
+
+def unpack(planes, n):
+    """
+    (16, 8, W) uint64 bit planes -> (n, 16) uint8 blocks
+    """
+    columns = np.zeros((BLOCKSIZE, planes.shape[2] * 64), dtype=np.uint8)
+    for i in range(8):
+        columns |= np.unpackbits(np.ascontiguousarray(planes[:, i]).view(np.uint8), axis=1, bitorder='little') << i
+    return np.ascontiguousarray(columns.T[:n])
+
+def round_key_masks(ks):
+    """
+    (Nr + 1, 16, 8, 1) uint64 masks, all ones where a round key bit is set
+    """
+    def build(ks):
+        rk = batch.round_keys(ks)
+        bits = np.unpackbits(rk[:, :, None], axis=2, bitorder='little').astype(np.uint64)
+        return (bits * ONES)[..., None]
+    return ks.derive('bitslice', build)
+
+def _invaffine(b):
+    """
+    inverse affine map: b_i = b'_(i+2) + b'_(i+5) + b'_(i+7) + 0x05_i
+    """
+    out = [b[(i + 2) % 8] ^ b[(i + 5) % 8] ^ b[(i + 7) % 8] for i in range(8)]
+    for i in (0, 2):                                        # 0x05
+        out[i] = ~out[i]
+    return out
+
+def sbox_circuit(U0, U1, U2, U3, U4, U5, U6, U7):
+    """
+    Boyar-Peralta S-box: U0 the most significant input bit, returns S0 (most significant) .. S7
+    J. Boyar, R. Peralta, A new combinational logic minimization technique with applications to cryptology (2010)
+    """
+    # top linear transform
+    T1 = U0 ^ U3; T2 = U0 ^ U5; T3 = U0 ^ U6; T4 = U3 ^ U5; T5 = U4 ^ U6
+    T6 = T1 ^ T5; T7 = U1 ^ U2; T8 = U7 ^ T6; T9 = U7 ^ T7; T10 = T6 ^ T7
+    T11 = U1 ^ U5; T12 = U2 ^ U5; T13 = T3 ^ T4; T14 = T6 ^ T11; T15 = T5 ^ T11
+    T16 = T5 ^ T12; T17 = T9 ^ T16; T18 = U3 ^ U7; T19 = T7 ^ T18; T20 = T1 ^ T19
+    T21 = U6 ^ U7; T22 = T7 ^ T21; T23 = T2 ^ T22; T24 = T2 ^ T10; T25 = T20 ^ T17
+    T26 = T3 ^ T16; T27 = T1 ^ T12
+    # shared non linear middle: inversion in GF(2^4) and the multiplications around it
+    M1 = T13 & T6; M2 = T23 & T8; M3 = T14 ^ M1; M4 = T19 & U7; M5 = M4 ^ M1
+    M6 = T3 & T16; M7 = T22 & T9; M8 = T26 ^ M6; M9 = T20 & T17; M10 = M9 ^ M6
+    M11 = T1 & T15; M12 = T4 & T27; M13 = M12 ^ M11; M14 = T2 & T10; M15 = M14 ^ M11
+    M16 = M3 ^ M2; M17 = M5 ^ T24; M18 = M8 ^ M7; M19 = M10 ^ M15; M20 = M16 ^ M13
+    M21 = M17 ^ M15; M22 = M18 ^ M13; M23 = M19 ^ T25; M24 = M22 ^ M23; M25 = M22 & M20
+    M26 = M21 ^ M25; M27 = M20 ^ M21; M28 = M23 ^ M25; M29 = M28 & M27; M30 = M26 & M24
+    M31 = M20 & M23; M32 = M27 & M31; M33 = M27 ^ M25; M34 = M21 & M22; M35 = M24 & M34
+    M36 = M24 ^ M25; M37 = M21 ^ M29; M38 = M32 ^ M33; M39 = M23 ^ M30; M40 = M35 ^ M36
+    M41 = M38 ^ M40; M42 = M37 ^ M39; M43 = M37 ^ M38; M44 = M39 ^ M40; M45 = M42 ^ M41
+    M46 = M44 & T6; M47 = M40 & T8; M48 = M39 & U7; M49 = M43 & T16; M50 = M38 & T9
+    M51 = M37 & T17; M52 = M42 & T15; M53 = M45 & T27; M54 = M41 & T10; M55 = M44 & T13
+    M56 = M40 & T23; M57 = M39 & T19; M58 = M43 & T3; M59 = M38 & T22; M60 = M37 & T20
+    M61 = M42 & T1; M62 = M45 & T4; M63 = M41 & T2
+    # bottom linear transform, the affine constant 0x63 as XNORs
+    L0 = M61 ^ M62; L1 = M50 ^ M56; L2 = M46 ^ M48; L3 = M47 ^ M55; L4 = M54 ^ M58
+    L5 = M49 ^ M61; L6 = M62 ^ L5; L7 = M46 ^ L3; L8 = M51 ^ M59; L9 = M52 ^ M53
+    L10 = M53 ^ L4; L11 = M60 ^ L2; L12 = M48 ^ M51; L13 = M50 ^ L0; L14 = M52 ^ M61
+    L15 = M55 ^ L1; L16 = M56 ^ L0; L17 = M57 ^ L1; L18 = M58 ^ L8; L19 = M63 ^ L4
+    L20 = L0 ^ L1; L21 = L1 ^ L7; L22 = L3 ^ L12; L23 = L18 ^ L2; L24 = L15 ^ L9
+    L25 = L6 ^ L10; L26 = L7 ^ L9; L27 = L8 ^ L10; L28 = L11 ^ L14; L29 = L11 ^ L17
+    return (L6 ^ L24, ~(L16 ^ L26), ~(L19 ^ L28), L6 ^ L21,
+            L20 ^ L22, L25 ^ L29, ~(L13 ^ L27), ~(L6 ^ L23))
+
+def _sbox(b):
+    """
+    S-box on a list of 8 bit planes, bit i first
+    """
+    return sbox_circuit(*b[::-1])[::-1]
+
+def subbytes(s):
+    return np.stack(_sbox([s[:, i] for i in range(8)]), axis=1)
+
+def invsubbytes(s):
+    """
+    x^-1 = A^-1(S(x)), so S^-1(y) = A^-1(S(A^-1(y)))
+    """
+    return np.stack(_invaffine(_sbox(_invaffine([s[:, i] for i in range(8)]))), axis=1)
+
+def xtime(s):
+    """
+    multiplication by x of every byte: a shift of the bit planes, x^8 folded back as 0x1b
+    """
+    hi = s[:, 7]
+    out = np.empty_like(s)
+    out[:, 0] = hi
+    out[:, 1] = s[:, 0] ^ hi
+    out[:, 2] = s[:, 1]
+    out[:, 3] = s[:, 2] ^ hi
+    out[:, 4] = s[:, 3] ^ hi
+    out[:, 5:] = s[:, 4:7]
+    return out
+
+def mixcolumns(s):
+    """
+    2 a_r + 3 a_(r+1) + a_(r+2) + a_(r+3) = xtime(a_r + a_(r+1)) + a_(r+1) + a_(r+2) + a_(r+3)
+    """
+    s1 = s[batch.ROT1]
+    return xtime(s ^ s1) ^ s1 ^ s[batch.ROT2] ^ s[batch.ROT3]
+
+def invmixcolumns(s):
+    """
+    InvMixColumns = MixColumns after a_r += xtime(xtime(a_r + a_(r+2)))
+    """
+    return mixcolumns(s ^ xtime(xtime(s ^ s[batch.ROT2])))
+
+def _encrypt(blocks, rk):
+    nr = len(rk) - 1
+    s = pack(blocks) ^ rk[0]
+    for r in range(1, nr):
+        s = mixcolumns(subbytes(s[batch.SHIFTROWS])) ^ rk[r]
+    s = subbytes(s[batch.SHIFTROWS]) ^ rk[nr]
+    return unpack(s, len(blocks))
+
+def _decrypt(blocks, rk):
+    nr = len(rk) - 1
+    s = pack(blocks) ^ rk[nr]
+    for r in range(nr - 1, 0, -1):
+        s = invmixcolumns(invsubbytes(s[batch.INVSHIFTROWS]) ^ rk[r])
+    s = invsubbytes(s[batch.INVSHIFTROWS]) ^ rk[0]
+    return unpack(s, len(blocks))
+
+def _lanes(fn, blocks, ks):
+    """
+    fn over LANE_BLOCKS blocks at a time, so the ~110 temporaries of the S-box circuit stay in cache
+    """
+    rk = round_key_masks(ks)
+    if len(blocks) <= LANE_BLOCKS:
+        return fn(blocks, rk)
+    out = np.empty_like(blocks)
+    for i in range(0, len(blocks), LANE_BLOCKS):
+        out[i:i + LANE_BLOCKS] = fn(blocks[i:i + LANE_BLOCKS], rk)
+    return out
+
+def encrypt_blocks(blocks, ks):
+    """
+    blocks: (N, 16) uint8 array of plain text
+    return: (N, 16) uint8 array of cipher text, identical to batch.encrypt_blocks()
+    """
+    return _lanes(_encrypt, blocks, ks)
+
+def decrypt_blocks(blocks, ks):
+    return _lanes(_decrypt, blocks, ks)
+
+def ecb_encrypt(ks, data):
+    return batch.ecb_encrypt(ks, data, kernel=encrypt_blocks)
+
+def ecb_decrypt(ks, data):
+    return batch.ecb_decrypt(ks, data, kernel=decrypt_blocks)
+
+def ctr_xor(ks, nonce, data, start=0):
+    return batch.ctr_xor(ks, nonce, data, start, kernel=encrypt_blocks)
+
+def cbc_decrypt(ks, iv, data):
+    return batch.cbc_decrypt(ks, iv, data, kernel=decrypt_blocks)
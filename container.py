@@ -0,0 +1,182 @@
+"""
+Chunked container: the payload is split into chunks of chunk_size plain text
+bytes, each encrypted on its own by AES.cipher_mode() with its own IV or
+nonce, so chunks are written and read in parallel and any one of them is
+decrypted without the others.
+
+    header  magic 'AESC', version, mode, chunk_size, chunk count, plain text size
+    index   per chunk: offset and length of its cipher text, IV/nonce, tag
+    chunks  cipher text of every chunk, in order
+
+CBC and CTR chunks are PKCS#7 padded like AES.cipher_mode(); GCM chunks carry
+their tag in the index and authenticate the whole header and their chunk
+number as additional data, so chunks cannot be swapped and the chunk count or
+size cannot be rewritten to drop trailing chunks. The tag is all zeros for CBC
+and CTR.
+"""
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+
+from AES import AES
+from utils import BLOCKSIZE, Source
+
+MAGIC = b'AESC'
+VERSION = 2                                                 # 2: the GCM AAD covers the header
+MODES = ('CBC', 'CTR', 'GCM')
+IVSIZE = {'CBC': BLOCKSIZE, 'CTR': BLOCKSIZE // 2, 'GCM': 12}
+TAGSIZE = 16
+CHUNK_SIZE = 1 << 20                                        # plain text bytes per chunk
+HEADER = struct.Struct('>4sBBxxQQQ')                        # magic, version, mode, chunk_size, count, size
+ENTRY = struct.Struct('>QQ16s16s')                          # offset, length, IV (zero padded), tag
+
+def ctsize(mode, n):
+    """
+    cipher text length of a chunk of n plain text bytes
+    """
+    return n if mode == 'GCM' else (n // BLOCKSIZE + 1) * BLOCKSIZE
+
+def aad(header, number):
+    """
+    GCM additional data of chunk number: the packed header, then the chunk number
+    """
+    return bytes(header) + number.to_bytes(8, 'big')
+
+def _encrypt_chunk(key, mode, engine, aad, data):
+    """
+    return: (iv, cipher text, tag) of one chunk
+    """
+    aes = AES.new(key, mode, engine=engine)
+    aes.plaintext = data
+    if mode == 'GCM':
+        aes.aad = aad
+    else:
+        aes.padding()
+    aes.cipher_mode(mode=mode)
+    ivsize = IVSIZE[mode]
+    if mode == 'GCM':
+        return aes.ciphertext[:ivsize], aes.ciphertext[ivsize:-TAGSIZE], aes.ciphertext[-TAGSIZE:]
+    return aes.ciphertext[:ivsize], aes.ciphertext[ivsize:], bytes(TAGSIZE)
+
+def _decrypt_chunk(key, mode, engine, aad, iv, ct, tag):
+    aes = AES.new(key, mode, engine=engine)
+    if mode == 'GCM':
+        aes.aad = aad
+        aes.ciphertext = iv + ct + tag
+    else:
+        aes.ciphertext = iv + ct
+    aes.ctblocks = [ct[i:i + BLOCKSIZE] for i in range(0, len(ct), BLOCKSIZE)]
+    aes.invcipher_mode(mode=mode)
+    return aes.plaintext
+
+def _run(fn, tasks, processes):
+    """
+    fn(*task) for every task, results in order; at most 2 * processes tasks in flight
+    """
+    if processes == 1:
+        for task in tasks:
+            yield fn(*task)
+        return
+    processes = processes or os.cpu_count()
+    with ProcessPoolExecutor(processes) as pool:
+        futures = []
+        for task in tasks:
+            futures.append(pool.submit(fn, *task))
+            if len(futures) >= 2 * processes:
+                yield futures.pop(0).result()
+        for future in futures:
+            yield future.result()
+
+def write(key, data, dst, mode:str='CTR', chunk_size:int=CHUNK_SIZE, processes:int=None, engine:str=None):
+    """
+    encrypt data (bytes-like, e.g. a mmap) into the container file dst (a path or a binary file object)
+    processes: encrypt chunks on a pool of this many processes, 1 for none
+    engine: one of AES.ENGINES, the per call choice of backends.select() if None
+    return: bytes written
+    """
+    assert mode in MODES and chunk_size > 0
+    view = memoryview(data).cast('B')
+    size = len(view)
+    count = -(-size // chunk_size)
+    lengths = [ctsize(mode, min(chunk_size, size - i * chunk_size)) for i in range(count)]
+    fout = open(dst, 'wb') if isinstance(dst, (str, os.PathLike)) else dst
+    try:
+        base = fout.tell()
+        offset = HEADER.size + count * ENTRY.size           # chunks follow the index, their sizes are known
+        header = HEADER.pack(MAGIC, VERSION, MODES.index(mode), chunk_size, count, size)
+        fout.write(header)
+        fout.seek(base + offset)
+        tasks = ((bytes(key), mode, engine, aad(header, i), bytes(view[i * chunk_size:(i + 1) * chunk_size])) for i in range(count))
+        index = []
+        for length, (iv, ct, tag) in zip(lengths, _run(_encrypt_chunk, tasks, processes)):
+            assert len(ct) == length
+            index.append(ENTRY.pack(offset, length, iv.ljust(16, b'\x00'), tag))
+            fout.write(ct)
+            offset += length
+        fout.seek(base + HEADER.size)
+        fout.write(b''.join(index))
+        fout.seek(base + offset)
+    finally:
+        if fout is not dst:
+            fout.close()
+    return offset
+
+class Reader():
+    """
+    random access to a container: read_chunk(i), read(offset, length), or read_all() in parallel
+    source: the container as bytes-like data, a binary file object or a path
+    """
+    def __init__(self, key, source, engine:str=None):
+        self.key = bytes(key)
+        self.engine = engine
+        self.src = Source(source)
+        self.header = self.src.pread(0, HEADER.size)
+        if len(self.header) != HEADER.size:
+            raise ValueError('not an AES container')
+        magic, version, mode, self.chunk_size, self.count, self.size = HEADER.unpack(self.header)
+        if magic != MAGIC or version != VERSION or mode >= len(MODES):
+            raise ValueError('not an AES container')
+        self.mode = MODES[mode]
+        table = self.src.pread(HEADER.size, self.count * ENTRY.size)
+        if len(table) != self.count * ENTRY.size:
+            raise ValueError('truncated container index')
+        self.index = [ENTRY.unpack_from(table, i * ENTRY.size) for i in range(self.count)]
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.src.close()
+
+    def _task(self, i):
+        offset, length, iv, tag = self.index[i]
+        return (self.key, self.mode, self.engine, aad(self.header, i), iv[:IVSIZE[self.mode]], self.src.pread(offset, length), tag)
+
+    def read_chunk(self, i):
+        """
+        plain text of chunk i alone
+        """
+        return _decrypt_chunk(*self._task(i))
+
+    def read(self, offset, length):
+        """
+        plain text bytes [offset, offset + length), decrypting only the chunks that cover them
+        """
+        offset, end = max(offset, 0), min(offset + length, self.size)
+        if end <= offset:
+            return b''
+        first, last = offset // self.chunk_size, (end - 1) // self.chunk_size
+        data = b''.join(self.read_chunk(i) for i in range(first, last + 1))
+        return data[offset - first * self.chunk_size:end - first * self.chunk_size]
+
+    def read_all(self, processes:int=None):
+        """
+        the whole plain text, chunks decrypted on a pool of this many processes
+        """
+        return b''.join(_run(_decrypt_chunk, (self._task(i) for i in range(self.count)), processes))
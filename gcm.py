@@ -0,0 +1,227 @@
+"""
+Galois/Counter Mode (NIST SP 800-38D): CTR encryption with a 32 bits counter
+and a GHASH tag over the additional data and the cipher text, in one pass.
+
+GHASH multiplies by the hash key H with Shoup's tables: X * H is linear in X,
+so it is the XOR of 16 lookups, one per byte of X, in 16 tables of 256
+products computed once per key and cached with the KeySchedule.
+
+Cipher text: the 12 bytes IV, the encrypted data, the 16 bytes tag. The data
+is not padded.
+"""
+import os
+import hmac
+
+import numpy as np
+
+from utils import BLOCKSIZE
+
+IVSIZE = 12                                                 # recommended IV length, other lengths go through GHASH
+TAGSIZE = 16
+BATCH_BLOCKS = 1 << 16                                      # keystream blocks encrypted at once
+R = 0xe1 << 120                                             # x^128 = x^7 + x^2 + x + 1, bit reflected
+
+def ghash_tables(h):
+    """
+    h: the hash key E_K(0^128)
+    return: tables[p][b] = (b at byte p of a block) * H, as ints
+    """
+    hx = []                                                 # H * x^i for i in 0..127
+    v = int.from_bytes(h, 'big')
+    for i in range(128):
+        hx.append(v)
+        v = (v >> 1) ^ (R if v & 1 else 0)
+    tables = []
+    for p in range(BLOCKSIZE):
+        t = [0] * 256
+        for k in range(8):
+            t[0x80 >> k] = hx[8 * p + k]
+        for b in range(1, 256):
+            low = b & -b
+            if b != low:
+                t[b] = t[b ^ low] ^ t[low]
+        tables.append(t)
+    return tables
+
+class GHASH():
+    """
+    incremental GHASH: update() the additional data, start() the cipher text, update() it, digest()
+    """
+    def __init__(self, tables):
+        self.tables = tables
+        self.y = 0
+        self.buffer = b''                                   # bytes of an incomplete block
+        self.aadlen = 0
+        self.ctlen = 0
+        self.started = False
+
+    def _absorb(self, data):
+        t0, t1, t2, t3, t4, t5, t6, t7, t8, t9, t10, t11, t12, t13, t14, t15 = self.tables
+        y = self.y
+        for i in range(0, len(data), BLOCKSIZE):
+            b = (y ^ int.from_bytes(data[i:i + BLOCKSIZE], 'big')).to_bytes(BLOCKSIZE, 'big')
+            y = (t0[b[0]] ^ t1[b[1]] ^ t2[b[2]] ^ t3[b[3]] ^ t4[b[4]] ^ t5[b[5]] ^ t6[b[6]] ^ t7[b[7]] ^
+                 t8[b[8]] ^ t9[b[9]] ^ t10[b[10]] ^ t11[b[11]] ^ t12[b[12]] ^ t13[b[13]] ^ t14[b[14]] ^ t15[b[15]])
+        self.y = y
+
+    def _flush(self):
+        if self.buffer:
+            self._absorb(self.buffer.ljust(BLOCKSIZE, b'\x00'))
+            self.buffer = b''
+
+    def update(self, data):
+        if self.started:
+            self.ctlen += len(data)
+        else:
+            self.aadlen += len(data)
+        data = self.buffer + bytes(data)
+        n = len(data) - len(data) % BLOCKSIZE
+        self.buffer = data[n:]
+        self._absorb(data[:n])
+
+    def start(self):
+        """
+        end of the additional data, the cipher text starts on a block boundary
+        """
+        if not self.started:
+            self._flush()
+            self.started = True
+
+    def digest(self):
+        self.start()
+        self._flush()
+        self._absorb((8 * self.aadlen).to_bytes(8, 'big') + (8 * self.ctlen).to_bytes(8, 'big'))
+        return self.y.to_bytes(BLOCKSIZE, 'big')
+
+def counter_blocks(j0, start, n):
+    """
+    (n, 16) uint8 array of the counter blocks inc32^(start)(J0) .. inc32^(start + n - 1)(J0)
+    """
+    ctr = np.empty((n, BLOCKSIZE), dtype=np.uint8)
+    ctr[:, :IVSIZE] = np.frombuffer(j0[:IVSIZE], dtype=np.uint8)
+    low = int.from_bytes(j0[IVSIZE:], 'big') + start
+    ctr[:, IVSIZE:] = ((low + np.arange(n, dtype=np.uint64)) & 0xffffffff).astype('>u4').view(np.uint8).reshape(n, 4)
+    return ctr
+
+class _Context():
+    def __init__(self, aes, aad=b''):
+        assert aes.key is not None
+        self.aes = aes
+        ks = aes.keyschedule()
+        self.ghash = GHASH(ks.derive('ghash', lambda ks: ghash_tables(aes.encrypt_block(bytes(BLOCKSIZE)))))
+        self.offset = 0                                     # bytes of data processed
+        self.finalized = False
+        self.authenticate(aad)
+
+    def _setiv(self, iv):
+        assert len(iv) > 0
+        self.iv = iv
+        if len(iv) == IVSIZE:
+            self.j0 = iv + b'\x00\x00\x00\x01'
+        else:
+            g = GHASH(self.ghash.tables)
+            g.update(iv)
+            g._flush()
+            g._absorb(bytes(8) + (8 * len(iv)).to_bytes(8, 'big'))
+            self.j0 = g.y.to_bytes(BLOCKSIZE, 'big')
+
+    def authenticate(self, aad):
+        """
+        feed additional authenticated data; only before the first update()
+        """
+        assert not self.ghash.started, 'additional data after the data'
+        self.ghash.update(aad)
+
+    def _crypt(self, data):
+        """
+        XOR data with the keystream at self.offset, in batches of BATCH_BLOCKS blocks
+        """
+        data = np.frombuffer(data, dtype=np.uint8)
+        out = np.empty_like(data)
+        done = 0
+        while done < len(data):
+            first, skip = divmod(self.offset, BLOCKSIZE)
+            n = min(-(-(skip + len(data) - done) // BLOCKSIZE), BATCH_BLOCKS)
+            ks = np.frombuffer(self.aes.encrypt_blocks(counter_blocks(self.j0, 1 + first, n).tobytes()), dtype=np.uint8)
+            m = min(n * BLOCKSIZE - skip, len(data) - done)
+            out[done:done + m] = data[done:done + m] ^ ks[skip:skip + m]
+            done += m
+            self.offset += m
+        return out.tobytes()
+
+    def _tag(self):
+        s = int.from_bytes(self.aes.encrypt_block(self.j0), 'big')
+        return (s ^ int.from_bytes(self.ghash.digest(), 'big')).to_bytes(BLOCKSIZE, 'big')
+
+class Encryptor(_Context):
+    """
+    update(chunk) returns the IV (first call) and the cipher text of chunk, finalize() returns the tag
+    """
+    def __init__(self, aes, iv=None, aad=b''):
+        super().__init__(aes, aad)
+        self._setiv(iv or os.urandom(IVSIZE))
+        self.header = self.iv
+
+    def update(self, chunk):
+        assert not self.finalized
+        self.ghash.start()
+        ct = self._crypt(chunk)
+        self.ghash.update(ct)
+        out, self.header = self.header + ct, b''
+        return out
+
+    def finalize(self):
+        assert not self.finalized
+        self.finalized = True
+        out, self.header = self.header + self._tag(), b''
+        return out
+
+class Decryptor(_Context):
+    """
+    update(chunk) returns plain text as it arrives, holding back the last 16 bytes (the tag);
+    finalize() raises ValueError when the tag does not match, so nothing is authentic before it returns
+    """
+    def __init__(self, aes, aad=b'', ivsize=IVSIZE):
+        super().__init__(aes, aad)
+        self.ivsize = ivsize
+        self.buffer = b''
+
+    def update(self, chunk):
+        assert not self.finalized
+        data = self.buffer + bytes(chunk)
+        if self.ivsize:
+            if len(data) < self.ivsize:
+                self.buffer = data
+                return b''
+            self._setiv(data[:self.ivsize])
+            data, self.ivsize = data[self.ivsize:], 0
+        n = max(len(data) - TAGSIZE, 0)
+        self.buffer = data[n:]
+        self.ghash.start()
+        self.ghash.update(data[:n])
+        return self._crypt(data[:n])
+
+    def finalize(self):
+        assert not self.finalized
+        if self.ivsize or len(self.buffer) != TAGSIZE:
+            raise ValueError('truncated GCM cipher text')
+        self.finalized = True
+        if not hmac.compare_digest(self._tag(), self.buffer):
+            raise ValueError('GCM tag mismatch')
+        return b''
+
+def encrypt(aes, data, iv=None, aad=b''):
+    """
+    return: iv + cipher text + tag
+    """
+    enc = Encryptor(aes, iv, aad)
+    return enc.update(data) + enc.finalize()
+
+def decrypt(aes, data, aad=b''):
+    """
+    data: iv + cipher text + tag; raises ValueError when it is not authentic
+    """
+    dec = Decryptor(aes, aad)
+    pt = dec.update(data)
+    dec.finalize()
+    return pt
@@ -0,0 +1,166 @@
+"""
+CTR keystream computed ahead of time. The keystream of (key, nonce, counters)
+does not depend on the data, so a background thread encrypts counter blocks
+while the caller is idle and CTR reduces to one XOR:
+
+    cache = aes.keystream_cache(capacity=1 << 16, eviction='lru')
+    aes.cipher_mode('CTR')              # takes a fresh precomputed nonce
+    cache.prefetch(nonce, nbytes)       # decryption: the nonce is known early
+    aes.invcipher_mode('CTR')           # looks the keystream up
+
+Fresh nonces for encryption are kept in a pool of `fresh` entries; keystream
+of known nonces lives in a bounded cache of `capacity` blocks, evicted in
+'lru' or 'fifo' order. Both are refilled on the background thread.
+"""
+import os
+import queue
+import threading
+from collections import OrderedDict, deque
+
+import batch
+from utils import BLOCKSIZE
+
+NONCESIZE = BLOCKSIZE // 2
+SEGMENT_BLOCKS = 1 << 12                                    # blocks precomputed per fresh nonce
+CAPACITY = 1 << 16                                          # blocks kept for known nonces
+EVICTIONS = ('lru', 'fifo')
+
+class KeystreamCache():
+    def __init__(self, aes, capacity:int=CAPACITY, eviction:str='lru', fresh:int=4, segment_blocks:int=SEGMENT_BLOCKS):
+        """
+        aes: AES with its key set; the key schedule and the engine it has for CTR now encrypt the counter blocks,
+             later changes to aes.engine do not reach the background thread
+        capacity: blocks of keystream cached for known nonces
+        fresh: fresh nonces kept ready for encryption, segment_blocks blocks each
+        """
+        assert eviction in EVICTIONS
+        assert aes.key is not None
+        self.aes = aes
+        self.key = aes.key
+        self.engine = aes.choose('CTR', 'encrypt', segment_blocks * BLOCKSIZE)
+        self.cipher = type(aes).new(aes.key, 'CTR', engine=self.engine)        # private: only this cache uses it
+        self.ks = self.cipher.keyschedule()
+        self.capacity = capacity
+        self.eviction = eviction
+        self.fresh = fresh
+        self.segment_blocks = segment_blocks
+        self.pool = deque()                                 # (nonce, keystream) never handed out
+        self.cache = OrderedDict()                          # nonce -> keystream of blocks 0 .. n - 1
+        self.size = 0                                       # blocks in self.cache
+        self.pending = set()                                # nonces queued for prefetch
+        self.hits = self.misses = 0
+        self.lock = threading.Condition()
+        self.jobs = queue.Queue()
+        self.thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, daemon=True)
+            self.thread.start()
+            for _ in range(self.fresh):
+                self.jobs.put(None)
+        return self
+
+    def close(self):
+        if self.thread is not None:
+            self.jobs.put(False)
+            self.thread.join()
+            self.thread = None
+
+    def generate(self, nonce, start, n):
+        """
+        keystream of the counter blocks start .. start + n - 1, with self.engine
+        """
+        return self.cipher.encrypt_blocks(batch.counter_blocks(nonce, start, n).tobytes())
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is False:
+                return
+            if job is None:
+                nonce = os.urandom(NONCESIZE)
+                stream = self.generate(nonce, 0, self.segment_blocks)
+                with self.lock:
+                    self.pool.append((nonce, stream))
+            else:
+                nonce, nblocks = job
+                stream = self.generate(nonce, 0, nblocks)
+                with self.lock:
+                    self.pending.discard(nonce)
+                    self._store(nonce, stream)
+                    self.lock.notify_all()
+
+    def _store(self, nonce, stream):
+        nblocks = len(stream) // BLOCKSIZE
+        if nblocks > self.capacity:
+            return
+        old = self.cache.pop(nonce, None)
+        if old is not None:
+            self.size -= len(old) // BLOCKSIZE
+        self.cache[nonce] = stream
+        self.size += nblocks
+        while self.size > self.capacity:                    # lru and fifo both evict from the front
+            self.size -= len(self.cache.popitem(last=False)[1]) // BLOCKSIZE
+
+    def _extend(self, nonce, stream, nbytes):
+        if len(stream) < nbytes:
+            have = len(stream) // BLOCKSIZE
+            stream += self.generate(nonce, have, -(-nbytes // BLOCKSIZE) - have)
+        return stream
+
+    def take(self, nbytes):
+        """
+        encryption: a fresh nonce and its keystream of nbytes bytes
+        """
+        assert self.aes.key == self.key, 'key changed'
+        with self.lock:
+            entry = self.pool.popleft() if self.pool else None
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if entry is None:
+            entry = (os.urandom(NONCESIZE), b'')
+        elif self.thread is not None:
+            self.jobs.put(None)
+        nonce, stream = entry
+        return nonce, self._extend(nonce, stream, nbytes)[:nbytes]
+
+    def prefetch(self, nonce, nbytes):
+        """
+        decryption: compute the keystream of nonce in the background
+        """
+        assert self.thread is not None, 'start() the cache first'
+        with self.lock:
+            if nonce in self.pending or len(self.cache.get(nonce, b'')) >= nbytes:
+                return
+            self.pending.add(nonce)
+        self.jobs.put((bytes(nonce), -(-nbytes // BLOCKSIZE)))
+
+    def lookup(self, nonce, nbytes):
+        """
+        decryption: the keystream of nonce, nbytes bytes; waits for a pending prefetch, computes it on a miss
+        """
+        assert self.aes.key == self.key, 'key changed'
+        nonce = bytes(nonce)
+        with self.lock:
+            while nonce in self.pending:
+                self.lock.wait()
+            stream = self.cache.get(nonce)
+            if stream is not None and len(stream) >= nbytes:
+                self.hits += 1
+                if self.eviction == 'lru':
+                    self.cache.move_to_end(nonce)
+                return stream[:nbytes]
+            self.misses += 1
+        stream = self._extend(nonce, stream or b'', nbytes)
+        with self.lock:
+            self._store(nonce, stream)
+        return stream[:nbytes]
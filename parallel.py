@@ -0,0 +1,66 @@
+"""
+Multi-core CTR: the counter range is split into chunks that worker processes
+encrypt with the NumPy batch engine. Input and output live in
+multiprocessing.shared_memory segments so payloads are never pickled.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import batch
+from utils import BLOCKSIZE, get_key_schedule
+
+CHUNK_BLOCKS = 1 << 16                                      # blocks per task handed to a worker
+
+def _ctr_worker(src_name, dst_name, key, nonce, start, lo, hi):
+    """
+    XOR bytes [lo, hi) of src with the keystream into dst; lo is block aligned
+    """
+    src = shared_memory.SharedMemory(name=src_name)
+    dst = src if dst_name == src_name else shared_memory.SharedMemory(name=dst_name)
+    try:
+        ks = get_key_schedule(key)
+        pt = np.frombuffer(src.buf, dtype=np.uint8, count=hi - lo, offset=lo)
+        ct = np.frombuffer(dst.buf, dtype=np.uint8, count=hi - lo, offset=lo)
+        for i in range(0, hi - lo, batch.BATCH_BLOCKS * BLOCKSIZE):
+            j = min(i + batch.BATCH_BLOCKS * BLOCKSIZE, hi - lo)
+            stream = batch.ctr_keystream(ks, nonce, start + (lo + i) // BLOCKSIZE, -(-(j - i) // BLOCKSIZE))
+            np.bitwise_xor(pt[i:j], stream.reshape(-1)[:j - i], out=ct[i:j])
+        del pt, ct
+    finally:
+        src.close()
+        if dst is not src:
+            dst.close()
+
+def ctr_xor_shared(key, nonce, src, dst, length, start=0, processes=None, chunk_blocks=CHUNK_BLOCKS):
+    """
+    CTR over shared memory: dst[:length] = src[:length] XOR keystream, src and dst may be the same segment
+    src, dst: multiprocessing.shared_memory.SharedMemory
+    start: counter of the first block
+    """
+    assert len(nonce) == BLOCKSIZE // 2
+    assert chunk_blocks > 0
+    step = chunk_blocks * BLOCKSIZE
+    with ProcessPoolExecutor(processes or os.cpu_count()) as pool:
+        futures = [pool.submit(_ctr_worker, src.name, dst.name, bytes(key), bytes(nonce), start, lo, min(lo + step, length))
+                   for lo in range(0, length, step)]
+        for future in futures:
+            future.result()
+
+def ctr_xor(key, nonce, data, start=0, processes=None, chunk_blocks=CHUNK_BLOCKS):
+    """
+    CTR encryption and decryption of data on a process pool; byte identical to batch.ctr_xor
+    """
+    length = len(data)
+    if length == 0:
+        return b''
+    shm = shared_memory.SharedMemory(create=True, size=length)
+    try:
+        shm.buf[:length] = data
+        ctr_xor_shared(key, nonce, shm, shm, length, start, processes, chunk_blocks)
+        return bytes(shm.buf[:length])
+    finally:
+        shm.close()
+        shm.unlink()
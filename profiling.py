@@ -0,0 +1,202 @@
+"""
+Opt-in instrumentation of the reference pipeline. Nothing is wrapped until
+enable(): the stage functions are then rebound, in every module that imported
+them, to timing wrappers, and disable() puts the originals back, so the
+disabled cost is zero.
+
+    with profiling.profile() as stats:
+        aes.cipher_mode('CBC')
+    print(stats.report())
+
+Stages are the reference engine's round functions (list of lists and flat),
+key expansion, block2state/state2block and the mode level XOR; cipher_mode and
+invcipher_mode record blocks, bytes and time per mode; get_key_schedule
+records cache hits and misses. The T-table, NumPy and compiled engines do not
+go through the stage functions and only show up in the mode totals.
+
+trace_cipher()/trace_invcipher() list the intermediate states of every round
+with the labels of the FIPS-197 appendix C example values.
+"""
+import sys
+from time import perf_counter_ns
+from contextlib import contextmanager
+
+import utils
+import AES as _aes
+from utils import (
+    get_key_schedule, xor_block, subbytes_flat, invsubbytes_flat,
+    shiftrows_flat, invshiftrows_flat, mixcolumns_flat, invmixcolumns_flat,
+)
+
+STAGES = {                                                  # function name in utils -> stage
+    'keyexpansion': 'keyexpansion',
+    'block2state': 'block2state',
+    'state2block': 'state2block',
+    'addroundkey': 'addroundkey',
+    'xor_block': 'addroundkey',                             # 'xor' outside utils: the mode level XOR
+    'subbytes': 'subbytes', 'invsubbytes': 'subbytes',
+    'subbytes_flat': 'subbytes', 'invsubbytes_flat': 'subbytes',
+    'shiftrows': 'shiftrows', 'invshiftrows': 'shiftrows',
+    'shiftrows_flat': 'shiftrows', 'invshiftrows_flat': 'shiftrows',
+    'mixcolumns': 'mixcolumns', 'invmixcolumns': 'mixcolumns',
+    'mixcolumns_flat': 'mixcolumns', 'invmixcolumns_flat': 'mixcolumns',
+}
+MODE_METHODS = {'cipher_mode': 'encrypt', 'invcipher_mode': 'decrypt'}
+
+class Stats():
+    """
+    stages: stage -> [calls, nanoseconds]
+    modes: (mode, 'encrypt' or 'decrypt') -> {'calls', 'blocks', 'bytes', 'ns'}
+    cache: key schedule cache {'hits', 'misses'}
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.stages = {}
+        self.modes = {}
+        self.cache = {'hits': 0, 'misses': 0}
+
+    def add(self, stage, ns):
+        s = self.stages.setdefault(stage, [0, 0])
+        s[0] += 1
+        s[1] += ns
+
+    def add_mode(self, mode, direction, blocks, nbytes, ns):
+        m = self.modes.setdefault((mode, direction), {'calls': 0, 'blocks': 0, 'bytes': 0, 'ns': 0})
+        m['calls'] += 1
+        m['blocks'] += blocks
+        m['bytes'] += nbytes
+        m['ns'] += ns
+
+    def report(self):
+        lines = [f"{'stage':<14} {'calls':>10} {'ns':>14} {'ns/call':>10}"]
+        for stage, (calls, ns) in sorted(self.stages.items(), key=lambda item: -item[1][1]):
+            lines.append(f'{stage:<14} {calls:>10} {ns:>14} {ns // calls:>10}')
+        for (mode, direction), m in sorted(self.modes.items()):
+            lines.append(f"{mode} {direction}: {m['calls']} calls, {m['blocks']} blocks, {m['bytes']} bytes, {m['ns']} ns")
+        lines.append(f"key schedule cache: {self.cache['hits']} hits, {self.cache['misses']} misses")
+        return '\n'.join(lines)
+
+stats = Stats()
+_patched = []                                               # (owner, name, original) to restore
+
+def _timed(stage, fn):
+    def wrapper(*args, **kwargs):
+        t = perf_counter_ns()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stats.add(stage, perf_counter_ns() - t)
+    wrapper.__wrapped__ = fn
+    return wrapper
+
+def _counted(fn):
+    def wrapper(key):
+        stats.cache['hits' if bytes(key) in utils._schedules else 'misses'] += 1
+        return fn(key)
+    wrapper.__wrapped__ = fn
+    return wrapper
+
+def _mode(direction, fn):
+    def wrapper(self, mode='CBC', *args, **kwargs):
+        t = perf_counter_ns()
+        try:
+            return fn(self, mode, *args, **kwargs)
+        finally:
+            blocks = self.ctblocks if direction == 'encrypt' else self.ptblocks
+            stats.add_mode(mode, direction, len(blocks or ()), sum(len(b) for b in blocks or ()), perf_counter_ns() - t)
+    wrapper.__wrapped__ = fn
+    return wrapper
+
+def _patch(owner, name, wrapper):
+    _patched.append((owner, name, getattr(owner, name)))
+    setattr(owner, name, wrapper)
+
+def enabled():
+    return bool(_patched)
+
+def enable():
+    """
+    rebind the stage functions to timing wrappers wherever they were imported
+    """
+    if _patched:
+        return
+    modules = [m for m in list(sys.modules.values()) if m is not None and m is not sys.modules[__name__]]
+    for name, stage in STAGES.items():
+        fn = getattr(utils, name)
+        for module in modules:
+            if getattr(module, name, None) is fn:
+                _patch(module, name, _timed(stage if module is utils or name != 'xor_block' else 'xor', fn))
+    fn = utils.get_key_schedule
+    for module in modules:
+        if getattr(module, 'get_key_schedule', None) is fn:
+            _patch(module, 'get_key_schedule', _counted(fn))
+    for name, direction in MODE_METHODS.items():
+        _patch(_aes.AES, name, _mode(direction, getattr(_aes.AES, name)))
+
+def disable():
+    """
+    restore the original functions
+    """
+    while _patched:
+        owner, name, original = _patched.pop()
+        setattr(owner, name, original)
+
+@contextmanager
+def profile():
+    """
+    enable, yield the reset stats, disable on exit
+    """
+    stats.reset()
+    enable()
+    try:
+        yield stats
+    finally:
+        disable()
+
+def trace_cipher(block, key):
+    """
+    [(label, hex state)] of FIPS-197 CIPHER(), labels as in appendix C (round[ 1].s_box, ...)
+    """
+    rk = get_key_schedule(key).round_keys
+    nr = len(rk) - 1
+    out = [('round[ 0].input', block.hex()), ('round[ 0].k_sch', rk[0].hex())]
+    state = xor_block(block, rk[0])
+    for r in range(1, nr + 1):
+        label = f'round[{r:2}]'
+        out.append((f'{label}.start', state.hex()))
+        state = subbytes_flat(state)
+        out.append((f'{label}.s_box', state.hex()))
+        state = shiftrows_flat(state)
+        out.append((f'{label}.s_row', state.hex()))
+        if r < nr:
+            state = mixcolumns_flat(state)
+            out.append((f'{label}.m_col', state.hex()))
+        out.append((f'{label}.k_sch', rk[r].hex()))
+        state = xor_block(state, rk[r])
+    out.append((f'round[{nr:2}].output', state.hex()))
+    return out
+
+def trace_invcipher(block, key):
+    """
+    [(label, hex state)] of FIPS-197 INVCIPHER(), labels as in appendix C (round[ 1].is_row, ...)
+    """
+    rk = get_key_schedule(key).round_keys
+    nr = len(rk) - 1
+    out = [('round[ 0].iinput', block.hex()), ('round[ 0].ik_sch', rk[nr].hex())]
+    state = xor_block(block, rk[nr])
+    for r in range(1, nr + 1):
+        label = f'round[{r:2}]'
+        out.append((f'{label}.istart', state.hex()))
+        state = invshiftrows_flat(state)
+        out.append((f'{label}.is_row', state.hex()))
+        state = invsubbytes_flat(state)
+        out.append((f'{label}.is_box', state.hex()))
+        out.append((f'{label}.ik_sch', rk[nr - r].hex()))
+        state = xor_block(state, rk[nr - r])
+        if r < nr:
+            out.append((f'{label}.ik_add', state.hex()))
+            state = invmixcolumns_flat(state)
+    out.append((f'round[{nr:2}].ioutput', state.hex()))
+    return out
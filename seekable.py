@@ -0,0 +1,89 @@
+"""
+Random access to CTR cipher text (the nonce + blocks layout of AES.cipher_mode('CTR')).
+Block i is only XORed with the encryption of nonce + i.to_bytes(8, 'big'), so any byte
+range is decrypted from the counter blocks that cover it and nothing else.
+"""
+import io
+
+import batch
+from utils import BLOCKSIZE, Source, padding_length
+
+NONCESIZE = BLOCKSIZE // 2
+
+def _plaintext_size(ks, src, nonce):
+    """
+    length of the plain text, from the padding of the last block
+    """
+    ctlen = src.size - NONCESIZE
+    assert ctlen > 0 and ctlen % BLOCKSIZE == 0, 'not a CTR cipher text'
+    last = ctlen // BLOCKSIZE - 1
+    return ctlen - padding_length(batch.ctr_xor(ks, nonce, src.pread(NONCESIZE + last * BLOCKSIZE, BLOCKSIZE), start=last))
+
+def _decrypt(ks, src, nonce, offset, length):
+    """
+    plain text bytes [offset, offset + length), offset and length already within the plain text
+    """
+    if length <= 0:
+        return b''
+    first = offset // BLOCKSIZE
+    last = (offset + length - 1) // BLOCKSIZE
+    ct = src.pread(NONCESIZE + first * BLOCKSIZE, (last - first + 1) * BLOCKSIZE)
+    pt = batch.ctr_xor(ks, nonce, ct, start=first)
+    return pt[offset - first * BLOCKSIZE:offset - first * BLOCKSIZE + length]
+
+def decrypt_range(ks, source, offset, length):
+    """
+    decrypt plain text bytes [offset, offset + length) of a CTR cipher text
+    ks: utils.KeySchedule
+    source: the cipher text as bytes-like data, a binary file object or a path
+    return: at most length bytes, fewer at the end of the plain text
+    """
+    assert offset >= 0 and length >= 0
+    src = Source(source)
+    try:
+        nonce = src.pread(0, NONCESIZE)
+        size = _plaintext_size(ks, src, nonce)
+        return _decrypt(ks, src, nonce, offset, min(length, size - offset))
+    finally:
+        src.close()
+
+class CTRReader(io.RawIOBase):
+    """
+    read-only, seekable file object over the plain text of a CTR cipher text
+    """
+    def __init__(self, ks, source):
+        super().__init__()
+        self.ks = ks
+        self.src = Source(source)
+        self.nonce = self.src.pread(0, NONCESIZE)
+        self.size = _plaintext_size(ks, self.src, self.nonce)
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self.pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += self.size
+        assert offset >= 0, 'negative seek position'
+        self.pos = offset
+        return self.pos
+
+    def readinto(self, b):
+        data = _decrypt(self.ks, self.src, self.nonce, self.pos, min(len(b), self.size - self.pos))
+        b[:len(data)] = data
+        self.pos += len(data)
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self.src.close()
+        super().close()
@@ -0,0 +1,10 @@
+"""
+Builds the optional compiled core: python setup.py build_ext --inplace
+"""
+from setuptools import setup
+from Cython.Build import cythonize
+
+setup(
+    name='MyAES',
+    ext_modules=cythonize('_aescore.pyx'),
+)
@@ -0,0 +1,123 @@
+"""
+Incremental encryption and decryption with bounded memory. The output is the
+same as AES.cipher_mode()/invcipher_mode(): CBC cipher text starts with the IV,
+CTR cipher text with the 8 bytes nonce, and the plain text is PKCS#7 padded.
+"""
+import os
+
+import numpy as np
+
+import batch
+from utils import BLOCKSIZE, cleanup_last_block, pkcs7_pad
+
+MODES = ('CBC', 'CTR', 'ECB')
+
+def _xor(a, b):
+    return np.bitwise_xor(np.frombuffer(a, dtype=np.uint8), np.frombuffer(b, dtype=np.uint8)).tobytes()
+
+class _Context():
+    def __init__(self, aes):
+        assert aes.mode in MODES
+        self.aes = aes
+        self.mode = aes.mode
+        self.buffer = b''                                   # bytes of an incomplete block
+        self.counter = 0                                    # CTR: counter of the next block
+        self.finalized = False
+
+    def _ctr(self, data):
+        n = len(data) // BLOCKSIZE
+        counters = batch.counter_blocks(self.nonce, self.counter, n).tobytes()
+        self.counter += n
+        return _xor(data, self.aes.encrypt_blocks(counters))
+
+class Encryptor(_Context):
+    def __init__(self, aes):
+        super().__init__(aes)
+        self.header = b''
+        if self.mode == 'CBC':                              # aes.iv only when the caller set it, never written back
+            self.prev = self.header = aes.iv or os.urandom(BLOCKSIZE)
+        elif self.mode == 'CTR':
+            self.nonce = self.header = os.urandom(BLOCKSIZE // 2)
+
+    def _process(self, data):
+        if self.mode == 'CTR':
+            return self._ctr(data)
+        if self.mode == 'ECB':
+            return self.aes.encrypt_blocks(data)
+        out = []
+        prev = int.from_bytes(self.prev, 'big')
+        for i in range(0, len(data), BLOCKSIZE):
+            block = self.aes.encrypt_block((int.from_bytes(data[i:i + BLOCKSIZE], 'big') ^ prev).to_bytes(BLOCKSIZE, 'big'))
+            prev = int.from_bytes(block, 'big')
+            out.append(block)
+        self.prev = out[-1] if out else self.prev
+        return b''.join(out)
+
+    def update(self, chunk):
+        """
+        return the cipher text of every complete block received so far
+        """
+        assert not self.finalized
+        data = self.buffer + chunk
+        n = len(data) - len(data) % BLOCKSIZE
+        self.buffer = data[n:]
+        out, self.header = self.header + self._process(data[:n]), b''
+        return out
+
+    def finalize(self):
+        """
+        pad and encrypt the remaining bytes
+        """
+        assert not self.finalized
+        self.finalized = True
+        out, self.header = self.header + self._process(pkcs7_pad(self.buffer)), b''
+        return out
+
+class Decryptor(_Context):
+    def __init__(self, aes):
+        super().__init__(aes)
+        self.headerlen = {'CBC': BLOCKSIZE, 'CTR': BLOCKSIZE // 2, 'ECB': 0}[self.mode]
+        self.prev = None
+
+    def _process(self, data):
+        if self.mode == 'CTR':
+            return self._ctr(data)
+        if self.mode == 'ECB':
+            return self.aes.decrypt_blocks(data)
+        out = batch.cbc_unchain(self.aes.decrypt_blocks(data), self.prev, data)
+        self.prev = data[-BLOCKSIZE:]
+        return out
+
+    def update(self, chunk):
+        """
+        return the plain text of every complete block received so far, except the last one which holds the padding
+        """
+        assert not self.finalized
+        data = self.buffer + chunk
+        if self.headerlen:
+            if len(data) < self.headerlen:
+                self.buffer = data
+                return b''
+            if self.mode == 'CBC':
+                self.prev = data[:self.headerlen]
+            else:
+                self.nonce = data[:self.headerlen]
+            data, self.headerlen = data[self.headerlen:], 0
+        n = len(data) - len(data) % BLOCKSIZE
+        if n == len(data):
+            n -= BLOCKSIZE
+        if n <= 0:
+            self.buffer = data
+            return b''
+        self.buffer = data[n:]
+        return self._process(data[:n])
+
+    def finalize(self):
+        """
+        decrypt the last block and strip the padding
+        """
+        assert not self.finalized
+        if self.headerlen or len(self.buffer) != BLOCKSIZE:
+            raise ValueError('truncated cipher text')
+        self.finalized = True
+        return cleanup_last_block(self._process(self.buffer))
@@ -1,12 +1,36 @@
+import io
 import os
 import sys
+import socket
+import asyncio
+import json
+import mmap
+import tempfile
 import unittest
+from unittest import mock
 
-from AES import AES
+import numpy as np
+
+from AES import AES, ENGINES, crypt_file, main, _aescore
+import batch
+import bitslice
+import ttable
+import parallel
+import bench
+import gcm
+import xts
+import keystream
+import container
+import aio
+import threads
+import profiling
+import backends
+import utils
 from utils import (
     block_size_is_16, block2state,
     addroundkey, subbytes, shiftrows, mixcolumns, subword, rotword,
-    keyexpansion,
+    keyexpansion, KeySchedule, get_key_schedule,
+    state2block, xor_block, subbytes_flat, shiftrows_flat, mixcolumns_flat, SBOX, ISBOX,
 )
 
 Nk = 4
@@ -352,5 +376,912 @@ class TestUtils(unittest.TestCase):
         state_after = block2state(b'\x32\x43\xf6\xa8\x88\x5a\x30\x8d\x31\x31\x98\xa2\xe0\x37\x07\x34')
         [self.assertEqual(state[i], state_after[i]) for i in range(len(state_after))]
 
+class TestFlatState(unittest.TestCase):
+
+    def test_round_functions(self):
+        block = b'\x19\x3d\xe3\xbe\xa0\xf4\xe2\x2b\x9a\xc6\x8d\x2a\xe9\xf8\x48\x08'
+        self.assertEqual(subbytes_flat(block), state2block(subbytes(block2state(block))))
+        self.assertEqual(shiftrows_flat(block), state2block(shiftrows(block2state(block))))
+        self.assertEqual(mixcolumns_flat(block), state2block(mixcolumns(block2state(block))))
+        self.assertEqual(state2block(block2state(block)), block)
+
+    def test_xor_block(self):
+        self.assertEqual(xor_block(b'\x0f' * 16, b'\xff' * 16), b'\xf0' * 16)
+        self.assertEqual(xor_block(b'\x00\x01', b'\x01\x01\x01'), b'\x01\x00')
+
+class TestKeySchedule(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    def test_round_keys(self):
+        ks = KeySchedule(self.key)
+        self.assertEqual(len(ks.round_keys), Nr + 1)
+        self.assertEqual(ks.round_keys[0], self.key)
+        self.assertEqual(ks.round_keys[Nr], b'\xd0\x14\xf9\xa8\xc9\xee\x25\x89\xe1\x3f\x0c\xc8\xb6\x63\x0c\xa6')
+
+    def test_schedule_is_shared(self):
+        ks = get_key_schedule(self.key)
+        self.assertIs(get_key_schedule(bytearray(self.key)), ks)
+        aes1, aes2 = AES(), AES()
+        aes1.key = aes2.key = self.key
+        self.assertIs(aes1.keyschedule(), aes2.keyschedule())
+        aes1.key = bytes(16)
+        self.assertEqual(aes1.keyschedule().key, bytes(16))
+
+    def test_schedule_cache_threads(self):
+        keys = [os.urandom(16) for _ in range(2 * utils.SCHEDULE_CACHE_SIZE)]
+        list(threads.pool(4).map(get_key_schedule, keys * 4))
+        self.assertLessEqual(len(utils._schedules), utils.SCHEDULE_CACHE_SIZE)
+        self.assertIs(get_key_schedule(keys[-1]), get_key_schedule(keys[-1]))
+
+    def test_cbc_round_trip(self):
+        aes = AES()
+        aes.key = self.key
+        aes.plaintext = b'Cache the key schedule once per key, not once per block.'
+        aes.padding()
+        aes.cipher_mode(mode='CBC')
+        aes.invcipher_mode(mode='CBC')
+        self.assertEqual(aes.plaintext, b'Cache the key schedule once per key, not once per block.')
+
+class TestKeySizes(unittest.TestCase):
+    """
+    FIPS-197 Appendix A key expansions and Appendix C example vectors
+    """
+    plaintext = bytes.fromhex('00112233445566778899aabbccddeeff')
+    vectors = (
+        ('000102030405060708090a0b0c0d0e0f', 10, '69c4e0d86a7b0430d8cdb78070b4c55a'),
+        ('000102030405060708090a0b0c0d0e0f1011121314151617', 12, 'dda97ca4864cdfe06eaf70a0ec0d7191'),
+        ('000102030405060708090a0b0c0d0e0f101112131415161718191a1b1c1d1e1f', 14, '8ea2b7ca516745bfeafc49904b496089'),
+    )
+
+    def test_keyexpansion(self):
+        words = keyexpansion(bytes.fromhex('8e73b0f7da0e6452c810f32b809079e562f8ead2522c6b7b'))
+        self.assertEqual(len(words), 52)
+        self.assertEqual(words[51], b'\x01\x00\x22\x02')
+        words = keyexpansion(bytes.fromhex('603deb1015ca71be2b73aef0857d77811f352c073b6108d72d9810a30914dff4'))
+        self.assertEqual(len(words), 60)
+        self.assertEqual(words[59], b'\x70\x6c\x63\x1e')
+
+    def test_vectors(self):
+        for key, nr, ciphertext in self.vectors:
+            key, ciphertext = bytes.fromhex(key), bytes.fromhex(ciphertext)
+            self.assertEqual(KeySchedule(key).Nr, nr)
+            for engine in ('reference', 'ttable', 'numpy', 'cython'):
+                aes = AES.new(key, engine=engine)
+                self.assertEqual(aes.encrypt_block(self.plaintext), ciphertext)
+                self.assertEqual(aes.decrypt_block(ciphertext), self.plaintext)
+
+    def test_bad_key_size(self):
+        for size in (0, 15, 20, 33):
+            with self.assertRaises(ValueError):
+                KeySchedule(bytes(size))
+
+    def test_modes(self):
+        key = bytes(range(32))
+        for mode in ('CBC', 'CTR'):
+            aes = AES.new(key, mode, engine='numpy')
+            aes.plaintext = b'AES-256 for data under compliance rules'
+            aes.padding()
+            aes.cipher_mode(mode=mode)
+            aes.invcipher_mode(mode=mode)
+            self.assertEqual(aes.plaintext, b'AES-256 for data under compliance rules')
+
+class TestTTable(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+    pt = b'\x32\x43\xf6\xa8\x88\x5a\x30\x8d\x31\x31\x98\xa2\xe0\x37\x07\x34'
+    ct = b'\x39\x25\x84\x1d\x02\xdc\x09\xfb\xdc\x11\x85\x97\x19\x6a\x0b\x32'
+
+    def test_cipher(self):
+        aes = AES(engine='ttable')
+        aes.key = self.key
+        aes.ptblock = self.pt
+        self.assertEqual(aes.cipher(), block2state(self.ct))
+        aes.ctblock = self.ct
+        self.assertEqual(aes.invcipher(), block2state(self.pt))
+
+    def test_same_as_reference(self):
+        reference, fast = AES(engine='reference'), AES(engine='ttable')
+        reference.key = fast.key = self.key
+        for i in range(64):
+            block = bytes((i * 37 + j * 11) & 0xff for j in range(16))
+            self.assertEqual(fast.encrypt_block(block), reference.encrypt_block(block))
+            self.assertEqual(fast.decrypt_block(block), reference.decrypt_block(block))
+
+class TestBatch(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    def test_blocks(self):
+        ks = get_key_schedule(self.key)
+        blocks = np.frombuffer(os.urandom(16 * 100), dtype=np.uint8).reshape(100, 16)
+        reference = AES(engine='reference')
+        reference.key = self.key
+        ct = batch.encrypt_blocks(blocks, ks)
+        for i in range(len(blocks)):
+            self.assertEqual(ct[i].tobytes(), reference.encrypt_block(blocks[i].tobytes()))
+        self.assertTrue((batch.decrypt_blocks(ct, ks) == blocks).all())
+
+    def test_modes(self):
+        with open('summer.txt', 'rb') as fin:
+            text = fin.read()
+        for mode in ('CTR', 'ECB'):
+            aes, reference = AES(engine='numpy'), AES()
+            aes.key = reference.key = self.key
+            aes.plaintext = text
+            aes.padding()
+            aes.cipher_mode(mode=mode)
+            reference.ciphertext, reference.ctblocks = aes.ciphertext, aes.ctblocks
+            reference.invcipher_mode(mode=mode)
+            self.assertEqual(reference.plaintext, text)
+            aes.invcipher_mode(mode=mode)
+            self.assertEqual(aes.plaintext, text)
+
+    def test_ctr_empty(self):
+        for options in ({}, {'processes': 2}, {'workers': 2}):
+            aes = AES.new(self.key, 'CTR', engine='numpy')
+            aes.plaintext = b''
+            aes.padding()
+            aes.cipher_mode(mode='CTR', **options)
+            self.assertEqual(len(aes.ciphertext), 8 + 16)
+            aes.invcipher_mode(mode='CTR', **options)
+            self.assertEqual(aes.plaintext, b'')
+        with aes.keystream_cache():
+            aes.padding()
+            aes.cipher_mode(mode='CTR')
+            aes.invcipher_mode(mode='CTR')
+        self.assertEqual(aes.plaintext, b'')
+
+    def test_cbc_decrypt(self):
+        with open('buddha.txt', 'rb') as fin:
+            text = fin.read()
+        reference = AES()
+        reference.key = self.key
+        reference.plaintext = text
+        reference.padding()
+        reference.cipher_mode(mode='CBC')
+        aes = AES(engine='numpy')
+        aes.key = self.key
+        aes.ciphertext, aes.ctblocks = reference.ciphertext, reference.ctblocks
+        aes.invcipher_mode(mode='CBC')
+        self.assertEqual(aes.plaintext, text)
+
+    def test_encrypt_many(self):
+        messages = [(None, os.urandom(n)) for n in (0, 5, 16, 100, 33, 17)]
+        for mode, header in (('CBC', 16), ('CTR', 8)):
+            for (iv, plaintext), ciphertext in zip(messages, batch.encrypt_many(self.key, messages, mode=mode)):
+                aes = AES.new(self.key, mode)
+                aes.ciphertext = ciphertext
+                aes.ctblocks = [ciphertext[i:i + 16] for i in range(header, len(ciphertext), 16)]
+                aes.invcipher_mode(mode=mode)
+                self.assertEqual(aes.plaintext, plaintext)
+
+    def test_encrypt_many_same_as_cipher_mode(self):
+        iv = os.urandom(16)
+        aes = AES.new(self.key, 'CBC')
+        aes.iv = iv
+        aes.plaintext = b'one of many records'
+        aes.padding()
+        aes.cipher_mode(mode='CBC')
+        self.assertEqual(batch.encrypt_many(self.key, [(iv, b'one of many records')])[0], aes.ciphertext)
+
+    def test_expand_keys(self):
+        for size in (16, 24, 32):
+            keys = [os.urandom(size) for _ in range(5)]
+            rk = batch.expand_keys(keys)
+            self.assertEqual(rk.shape, (5, len(get_key_schedule(keys[0]).round_keys), 16))
+            for key, row in zip(keys, rk):
+                self.assertEqual(row.tobytes(), b''.join(get_key_schedule(key).round_keys))
+
+    def test_encrypt_multi(self):
+        keys = [os.urandom(16) for _ in range(6)]
+        plaintexts = [os.urandom(n) for n in (0, 5, 16, 100, 33, 17)]
+        for mode, header in (('CBC', 16), ('CTR', 8)):
+            ciphertexts = batch.encrypt_multi(keys, [None] * 6, plaintexts, mode=mode)
+            for key, plaintext, ciphertext in zip(keys, plaintexts, ciphertexts):
+                aes = AES.new(key, mode)
+                aes.ciphertext = ciphertext
+                aes.ctblocks = [ciphertext[i:i + 16] for i in range(header, len(ciphertext), 16)]
+                aes.invcipher_mode(mode=mode)
+                self.assertEqual(aes.plaintext, plaintext)
+            self.assertEqual(batch.decrypt_multi(keys, ciphertexts, mode=mode), plaintexts)
+            with self.assertRaises(ValueError):
+                batch.decrypt_multi(keys, ciphertexts[:5] + [ciphertexts[5][:-1]], mode=mode)
+
+class TestBitslice(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    def test_pack(self):
+        blocks = np.frombuffer(os.urandom(16 * 70), dtype=np.uint8).reshape(70, 16)
+        planes = bitslice.pack(blocks)
+        self.assertEqual(planes.shape, (16, 8, 2))
+        self.assertTrue((bitslice.unpack(planes, 70) == blocks).all())
+
+    def test_subbytes(self):
+        blocks = np.arange(256, dtype=np.uint8).reshape(16, 16)
+        planes = bitslice.pack(blocks)
+        self.assertEqual(bitslice.unpack(bitslice.subbytes(planes), 16).tobytes(), bytes(SBOX))
+        self.assertEqual(bitslice.unpack(bitslice.invsubbytes(planes), 16).tobytes(), bytes(ISBOX))
+
+    def test_same_as_cipher(self):
+        for key in (self.key, os.urandom(24), os.urandom(32)):
+            ks = get_key_schedule(key)
+            aes = AES()
+            aes.key = key
+            for n in (1, 64, 129):
+                blocks = np.frombuffer(os.urandom(16 * n), dtype=np.uint8).reshape(n, 16)
+                ct = bitslice.encrypt_blocks(blocks, ks)
+                for i in range(n):
+                    aes.ptblock = blocks[i].tobytes()
+                    self.assertEqual(state2block(aes.cipher()), ct[i].tobytes())
+                self.assertTrue((bitslice.decrypt_blocks(ct, ks) == blocks).all())
+
+    def test_modes(self):
+        with open('summer.txt', 'rb') as fin:
+            text = fin.read()
+        for mode in ('CBC', 'CTR', 'ECB'):
+            aes, reference = AES(engine='bitslice'), AES()
+            aes.key = reference.key = self.key
+            aes.plaintext = text
+            aes.padding()
+            aes.cipher_mode(mode=mode)
+            reference.ciphertext, reference.ctblocks = aes.ciphertext, aes.ctblocks
+            reference.invcipher_mode(mode=mode)
+            self.assertEqual(reference.plaintext, text)
+            aes.invcipher_mode(mode=mode)
+            self.assertEqual(aes.plaintext, text)
+
+    def test_single_blocks(self):
+        reference = AES.new(self.key, engine='reference')
+        aes = AES.new(self.key, engine='bitslice')
+        block = os.urandom(16)
+        with mock.patch.object(ttable, 'encrypt_block', side_effect=AssertionError), \
+                mock.patch.object(ttable, 'decrypt_block', side_effect=AssertionError):
+            self.assertEqual(aes.encrypt_block(block), reference.encrypt_block(block))
+            self.assertEqual(aes.decrypt_block(block), reference.decrypt_block(block))
+            aes.plaintext = b'CBC encryption is one block at a time'
+            aes.padding()
+            aes.cipher_mode(mode='CBC')
+            aes.invcipher_mode(mode='CBC')
+        self.assertEqual(aes.plaintext, b'CBC encryption is one block at a time')
+
+@unittest.skipUnless(_aescore, 'compiled core not built')
+class TestCython(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    def test_cipher(self):
+        aes = AES(engine='cython')
+        aes.key = self.key
+        aes.ptblock = b'\x32\x43\xf6\xa8\x88\x5a\x30\x8d\x31\x31\x98\xa2\xe0\x37\x07\x34'
+        self.assertEqual(aes.cipher(), block2state(b'\x39\x25\x84\x1d\x02\xdc\x09\xfb\xdc\x11\x85\x97\x19\x6a\x0b\x32'))
+
+    def test_modes(self):
+        with open('buddha.txt', 'rb') as fin:
+            text = fin.read()
+        for mode in ('CBC', 'CTR', 'ECB'):
+            aes, reference = AES(engine='cython'), AES(engine='reference')
+            aes.key = reference.key = self.key
+            aes.plaintext = reference.plaintext = text
+            aes.padding()
+            aes.cipher_mode(mode=mode)
+            reference.ciphertext, reference.ctblocks = aes.ciphertext, aes.ctblocks
+            reference.invcipher_mode(mode=mode)
+            self.assertEqual(reference.plaintext, text)
+            aes.invcipher_mode(mode=mode)
+            self.assertEqual(aes.plaintext, text)
+
+class TestParallel(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    def test_ctr_xor(self):
+        nonce = os.urandom(8)
+        data = os.urandom(16 * 300)
+        serial = batch.ctr_xor(get_key_schedule(self.key), nonce, data, start=7)
+        self.assertEqual(parallel.ctr_xor(self.key, nonce, data, start=7, processes=2, chunk_blocks=64), serial)
+
+    def test_modes(self):
+        with open('buddha.txt', 'rb') as fin:
+            text = fin.read()
+        aes, reference = AES(), AES()
+        aes.key = reference.key = self.key
+        aes.plaintext = text
+        aes.padding()
+        aes.cipher_mode(mode='CTR', processes=2)
+        reference.ciphertext, reference.ctblocks = aes.ciphertext, aes.ctblocks
+        reference.invcipher_mode(mode='CTR')
+        self.assertEqual(reference.plaintext, text)
+        aes.invcipher_mode(mode='CTR', processes=2)
+        self.assertEqual(aes.plaintext, text)
+
+class TestStream(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    def test_same_as_cipher_mode(self):
+        with open('summer.txt', 'rb') as fin:
+            text = fin.read()
+        for mode, header in (('CBC', 16), ('CTR', 8), ('ECB', 0)):
+            encryptor = AES.new(self.key, mode).encryptor()
+            ciphertext = b''.join([encryptor.update(text[i:i + 7]) for i in range(0, len(text), 7)]) + encryptor.finalize()
+            aes = AES.new(self.key, mode)
+            aes.ciphertext = ciphertext
+            aes.ctblocks = [ciphertext[i:i + 16] for i in range(header, len(ciphertext), 16)]
+            aes.invcipher_mode(mode=mode)
+            self.assertEqual(aes.plaintext, text)
+
+    def test_fresh_iv_per_encryptor(self):
+        for mode, header in (('CBC', 16), ('CTR', 8)):
+            aes = AES.new(self.key, mode)
+            first, second = aes.encryptor(), aes.encryptor()
+            self.assertNotEqual(first.header, second.header)
+            self.assertEqual(len(first.header), header)
+            self.assertIsNone(aes.iv)
+        aes = AES.new(self.key, 'CBC')
+        aes.iv = bytes(16)
+        self.assertEqual(aes.encryptor().header, bytes(16))
+
+    def test_round_trip(self):
+        for mode in ('CBC', 'CTR', 'ECB'):
+            for size in (0, 15, 16, 33):
+                text = os.urandom(size)
+                encryptor = AES.new(self.key, mode, engine='numpy').encryptor()
+                ciphertext = encryptor.update(text) + encryptor.finalize()
+                decryptor = AES.new(self.key, mode).decryptor()
+                plaintext = b''.join([decryptor.update(ciphertext[i:i + 5]) for i in range(0, len(ciphertext), 5)])
+                self.assertEqual(plaintext + decryptor.finalize(), text)
+
+class TestGCM(unittest.TestCase):
+
+    # McGrew and Viega, The Galois/Counter Mode of Operation, test cases 2 and 4
+    key = bytes.fromhex('feffe9928665731c6d6a8f9467308308')
+    iv = bytes.fromhex('cafebabefacedbaddecaf888')
+    plaintext = bytes.fromhex(
+        'd9313225f88406e5a55909c5aff5269a86a7a9531534f7da2e4c303d8a318a72'
+        '1c3c0c95956809532fcf0e2449a6b525b16aedf5aa0de657ba637b39')
+    aad = bytes.fromhex('feedfacedeadbeeffeedfacedeadbeefabaddad2')
+
+    def test_vectors(self):
+        ciphertext = gcm.encrypt(AES.new(bytes(16), 'GCM'), bytes(16), iv=bytes(12))
+        self.assertEqual(ciphertext[12:28].hex(), '0388dace60b6a392f328c2b971b2fe78')
+        self.assertEqual(ciphertext[28:].hex(), 'ab6e47d42cec13bdf53a67b21257bddf')
+        for engine in ENGINES:
+            ciphertext = gcm.encrypt(AES.new(self.key, 'GCM', engine=engine), self.plaintext, self.iv, self.aad)
+            self.assertEqual(ciphertext[12:-16].hex(),
+                '42831ec2217774244b7221b784d0d49ce3aa212f2c02a4e035c17e2329aca12e'
+                '21d514b25466931c7d8f6a5aac84aa051ba30b396a0aac973d58e091')
+            self.assertEqual(ciphertext[-16:].hex(), '5bc94fbc3221a5db94fae95ae7121a47')
+
+    def test_streaming(self):
+        encryptor = gcm.Encryptor(AES.new(self.key, 'GCM'), self.iv)
+        encryptor.authenticate(self.aad[:7])
+        encryptor.authenticate(self.aad[7:])
+        ciphertext = b''.join([encryptor.update(self.plaintext[i:i + 5]) for i in range(0, len(self.plaintext), 5)])
+        ciphertext += encryptor.finalize()
+        self.assertEqual(ciphertext, gcm.encrypt(AES.new(self.key, 'GCM'), self.plaintext, self.iv, self.aad))
+        decryptor = gcm.Decryptor(AES.new(self.key, 'GCM'), self.aad)
+        plaintext = b''.join([decryptor.update(ciphertext[i:i + 3]) for i in range(0, len(ciphertext), 3)])
+        decryptor.finalize()
+        self.assertEqual(plaintext, self.plaintext)
+
+    def test_tamper(self):
+        ciphertext = gcm.encrypt(AES.new(self.key, 'GCM'), self.plaintext, self.iv, self.aad)
+        for bad, aad in ((ciphertext[:20] + bytes([ciphertext[20] ^ 1]) + ciphertext[21:], self.aad),
+                         (ciphertext, self.aad[:-1]), (ciphertext[:-1], self.aad)):
+            with self.assertRaises(ValueError):
+                gcm.decrypt(AES.new(self.key, 'GCM'), bad, aad)
+
+    def test_cipher_mode(self):
+        with open('summer.txt', 'rb') as fin:
+            text = fin.read()
+        aes = AES.new(self.key, 'GCM', engine='numpy')
+        aes.plaintext, aes.aad = text, self.aad
+        aes.cipher_mode(mode='GCM')
+        self.assertEqual(len(aes.ciphertext), 12 + len(text) + 16)
+        aes.invcipher_mode(mode='GCM')
+        self.assertEqual(aes.plaintext, text)
+        with tempfile.TemporaryDirectory() as tmp:
+            enc, dec = os.path.join(tmp, 'enc'), os.path.join(tmp, 'dec')
+            crypt_file(AES.new(self.key, 'GCM'), 'summer.txt', enc, batch_size=100)
+            crypt_file(AES.new(self.key, 'GCM'), enc, dec, encrypt=False, batch_size=100)
+            with open(dec, 'rb') as fdec:
+                self.assertEqual(fdec.read(), text)
+
+    def test_crypt_file_tampered(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            enc, dec = os.path.join(tmp, 'enc'), os.path.join(tmp, 'dec')
+            crypt_file(AES.new(self.key, 'GCM'), 'summer.txt', enc, batch_size=100)
+            with open(enc, 'r+b') as fout:
+                fout.seek(40)
+                byte = fout.read(1)
+                fout.seek(40)
+                fout.write(bytes([byte[0] ^ 1]))
+            with self.assertRaises(ValueError):
+                crypt_file(AES.new(self.key, 'GCM'), enc, dec, encrypt=False, batch_size=100)
+            self.assertEqual(os.listdir(tmp), ['enc'])
+
+class TestXTS(unittest.TestCase):
+
+    def test_vectors(self):
+        # IEEE 1619-2007 annex B, vectors 2 and 3 (32 bytes data units); vector 1 has K1 == K2
+        key = bytes.fromhex('fffefdfcfbfaf9f8f7f6f5f4f3f2f1f0') + b'\x22' * 16
+        self.assertEqual(xts.encrypt_sectors(key, b'\x44' * 32, 0x3333333333, sector_size=32).hex(),
+            'af85336b597afc1a900b2eb21ec949d292df4c047e0b21532186a5971a227a89')
+        key = b'\x11' * 16 + b'\x22' * 16
+        ciphertext = xts.encrypt_sectors(key, b'\x44' * 32, 0x3333333333, sector_size=32)
+        self.assertEqual(ciphertext.hex(), 'c454185e6a16936e39334038acef838bfb186fff7480adc4289382ecd6d394f0')
+        self.assertEqual(xts.decrypt_sectors(key, ciphertext, 0x3333333333, sector_size=32), b'\x44' * 32)
+
+    def test_equal_key_halves(self):
+        with self.assertRaises(ValueError):
+            xts.encrypt_sectors(bytes(32), bytes(32), 0, sector_size=32)
+        with self.assertRaises(ValueError):
+            xts.decrypt_sectors(b'\x5a' * 64, bytes(4096), 0)
+
+    def test_random_access(self):
+        key = os.urandom(64)
+        data = os.urandom(4 * xts.SECTOR_SIZE)
+        ciphertext = xts.encrypt_sectors(key, data, 100)
+        self.assertEqual(xts.encrypt_sectors(key, data[2 * 4096:3 * 4096], [102]), ciphertext[2 * 4096:3 * 4096])
+        self.assertEqual(xts.decrypt_sectors(key, ciphertext[4096:] + ciphertext[:4096], [101, 102, 103, 100]),
+                         data[4096:] + data[:4096])
+
+    def test_image(self):
+        key = os.urandom(32)
+        data = os.urandom(10 * xts.SECTOR_SIZE)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'image')
+            with open(path, 'wb') as fout:
+                fout.write(data)
+            self.assertEqual(xts.encrypt_image(key, path, processes=2, chunk_sectors=3), 10)
+            with open(path, 'rb') as fin:
+                self.assertEqual(fin.read(), xts.encrypt_sectors(key, data))
+            xts.decrypt_image(key, path, [7, 2], processes=2, chunk_sectors=1)
+            with open(path, 'rb') as fin:
+                image = fin.read()
+            for sector in range(10):
+                plain = data[sector * 4096:(sector + 1) * 4096]
+                self.assertEqual(image[sector * 4096:(sector + 1) * 4096] == plain, sector in (7, 2))
+
+    def test_image_ranges(self):
+        key = os.urandom(32)
+        data = os.urandom(10 * xts.SECTOR_SIZE)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'image')
+            with open(path, 'wb') as fout:
+                fout.write(data)
+            with mock.patch.object(xts, '_image_worker', wraps=xts._image_worker) as worker:
+                self.assertEqual(xts.encrypt_image(key, path, range(2, 9), processes=1, chunk_sectors=4), 7)
+            self.assertEqual([call.args[2] for call in worker.call_args_list], [range(2, 6), range(6, 9)])
+            with open(path, 'rb') as fin:
+                image = fin.read()
+            self.assertEqual(image[2 * 4096:9 * 4096], xts.encrypt_sectors(key, data[2 * 4096:9 * 4096], 2))
+            self.assertEqual(image[:2 * 4096] + image[9 * 4096:], data[:2 * 4096] + data[9 * 4096:])
+            for sectors in (range(5, 11), [3, 3], [10]):
+                with self.assertRaises(ValueError):
+                    xts.encrypt_image(key, path, sectors)
+
+class TestKeystream(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    def test_cipher_mode(self):
+        with open('summer.txt', 'rb') as fin:
+            text = fin.read()
+        aes = AES.new(self.key, 'CTR', engine='numpy')
+        with aes.keystream_cache(fresh=2, segment_blocks=4) as cache:
+            aes.plaintext = text
+            aes.padding()
+            aes.cipher_mode(mode='CTR')
+            reference = AES.new(self.key, 'CTR')
+            reference.ciphertext, reference.ctblocks = aes.ciphertext, aes.ctblocks
+            reference.invcipher_mode(mode='CTR')
+            self.assertEqual(reference.plaintext, text)
+            cache.prefetch(aes.ciphertext[:8], len(aes.ciphertext) - 8)
+            aes.invcipher_mode(mode='CTR')
+            self.assertEqual(aes.plaintext, text)
+            self.assertGreaterEqual(cache.hits, 1)          # the lookup waits for its prefetch
+
+    def test_take(self):
+        cache = keystream.KeystreamCache(AES.new(self.key, 'CTR'))
+        nonce, stream = cache.take(40)
+        self.assertEqual(cache.misses, 1)
+        self.assertEqual(stream, batch.ctr_keystream(get_key_schedule(self.key), nonce, 0, 3).tobytes()[:40])
+
+    def test_engine_captured(self):
+        aes = AES.new(self.key, 'CTR', engine='numpy')
+        cache = keystream.KeystreamCache(aes)
+        aes.engine = 'reference'
+        with mock.patch.object(batch, 'encrypt_blocks', wraps=batch.encrypt_blocks) as kernel:
+            nonce, stream = cache.take(32)
+        self.assertTrue(kernel.called)
+        self.assertEqual(cache.engine, 'numpy')
+        self.assertEqual(stream, batch.ctr_keystream(get_key_schedule(self.key), nonce, 0, 2).tobytes())
+
+    def test_eviction(self):
+        for eviction, kept in (('lru', b'a' * 8), ('fifo', b'b' * 8)):
+            cache = keystream.KeystreamCache(AES.new(self.key, 'CTR'), capacity=4, eviction=eviction)
+            cache.lookup(b'a' * 8, 32)
+            cache.lookup(b'b' * 8, 32)
+            cache.lookup(b'a' * 8, 32)
+            cache.lookup(b'c' * 8, 32)
+            self.assertEqual(list(cache.cache), [kept, b'c' * 8])
+            self.assertEqual((cache.hits, cache.misses, cache.size), (1, 3, 4))
+
+class TestContainer(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    def test_round_trip(self):
+        with open('buddha.txt', 'rb') as fin:
+            text = fin.read()
+        for mode in container.MODES:
+            out = io.BytesIO()
+            written = container.write(self.key, text, out, mode, chunk_size=1000, processes=1)
+            self.assertEqual(written, len(out.getvalue()))
+            reader = container.Reader(self.key, out.getvalue())
+            self.assertEqual((reader.mode, len(reader), reader.size), (mode, -(-len(text) // 1000), len(text)))
+            self.assertEqual(reader.read_all(processes=1), text)
+            self.assertEqual(reader.read_chunk(1), text[1000:2000])
+            self.assertEqual(reader.read(999, 1502), text[999:2501])
+
+    def test_parallel(self):
+        data = os.urandom(100000)
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'container')
+            container.write(self.key, data, path, 'CBC', chunk_size=16384, processes=2, engine='ttable')
+            with container.Reader(self.key, path) as reader:
+                self.assertEqual(reader.read_all(processes=2), data)
+                self.assertEqual(reader.read_chunk(6), data[6 * 16384:])
+
+    def test_gcm_chunks_are_bound(self):
+        out = io.BytesIO()
+        container.write(self.key, b'x' * 3000, out, 'GCM', chunk_size=1000, processes=1)
+        data = bytearray(out.getvalue())
+        first = container.HEADER.size
+        entry = container.ENTRY.size
+        data[first:first + entry], data[first + entry:first + 2 * entry] = data[first + entry:first + 2 * entry], data[first:first + entry]
+        with self.assertRaises(ValueError):
+            container.Reader(self.key, bytes(data)).read_chunk(0)
+
+    def test_gcm_header_is_bound(self):
+        out = io.BytesIO()
+        container.write(self.key, b'x' * 3000, out, 'GCM', chunk_size=1000, processes=1)
+        magic, version, mode, chunk_size, count, size = container.HEADER.unpack_from(out.getvalue())
+        dropped = container.HEADER.pack(magic, version, mode, chunk_size, count - 1, size - 1000)
+        reader = container.Reader(self.key, dropped + out.getvalue()[container.HEADER.size:])
+        self.assertEqual((len(reader), reader.size), (2, 2000))
+        with self.assertRaises(ValueError):
+            reader.read_all(processes=1)
+
+class TestAsync(unittest.IsolatedAsyncioTestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    async def crypt(self, context, data):
+        """
+        feed data through a StreamReader, collect what context writes to a socket pair
+        """
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        a, b = socket.socketpair()
+        _, writer = await asyncio.open_connection(sock=a)
+        sink, _ = await asyncio.open_connection(sock=b)
+
+        async def run():
+            written = await context(reader, writer)
+            writer.close()
+            return written
+
+        written, out = await asyncio.gather(run(), sink.read())
+        self.assertEqual(written, len(out))
+        return out
+
+    async def test_round_trip(self):
+        data = os.urandom(50001)
+        for mode in ('CBC', 'CTR', 'ECB', 'GCM'):
+            ciphertext = await self.crypt(lambda r, w: aio.encrypt_stream(AES.new(self.key, mode, engine='numpy'), r, w,
+                                                                          chunk_size=5000, offload=1000), data)
+            aes = AES.new(self.key, mode)
+            plaintext = await self.crypt(lambda r, w: aio.decrypt_stream(aes, r, w, chunk_size=3333), ciphertext)
+            self.assertEqual(plaintext, data)
+
+    async def test_same_as_stream(self):
+        with open('summer.txt', 'rb') as fin:
+            text = fin.read()
+        aes = AES.new(self.key, 'CBC')
+        ciphertext = await self.crypt(lambda r, w: aio.AsyncEncryptor(aes, r, w, chunk_size=100).run(), text)
+        reference = AES.new(self.key, 'CBC')
+        reference.ciphertext = ciphertext
+        reference.ctblocks = [ciphertext[i:i + 16] for i in range(16, len(ciphertext), 16)]
+        reference.invcipher_mode(mode='CBC')
+        self.assertEqual(reference.plaintext, text)
+
+    async def test_gcm_tampered(self):
+        aes = AES.new(self.key, 'GCM')
+        aes.plaintext = os.urandom(20000)
+        aes.cipher_mode(mode='GCM')
+        tampered = bytearray(aes.ciphertext)
+        tampered[100] ^= 1
+        for data, max_held in ((bytes(tampered), aio.MAX_HELD), (aes.ciphertext, 10000)):
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            writer = mock.Mock(drain=mock.AsyncMock())
+            with self.assertRaises(ValueError):
+                await aio.decrypt_stream(AES.new(self.key, 'GCM'), reader, writer, chunk_size=1000, max_held=max_held)
+            writer.write.assert_not_called()
+
+class TestThreads(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    def test_slices(self):
+        self.assertEqual(threads.slices(16 * 100, 4, min_blocks=10), [(0, 400), (400, 800), (800, 1200), (1200, 1600)])
+        self.assertEqual(threads.slices(16 * 100, 4, min_blocks=40), [(0, 640), (640, 1280), (1280, 1600)])
+        self.assertEqual(threads.slices(0, 4), [])
+
+    def test_pool_is_shared(self):
+        executor = threads.pool(2)
+        self.assertIs(threads.pool(threads.MAX_WORKERS + 10), executor)
+        self.assertLessEqual(threads._size, threads.MAX_WORKERS)
+        self.assertEqual(executor.submit(sum, [1, 2]).result(), 3)
+
+    def test_modes(self):
+        text = os.urandom(100000)
+        for engine in ('numpy', 'cython', 'reference'):
+            for mode in ('CBC', 'CTR', 'ECB'):
+                aes, reference = AES(engine=engine), AES(engine='numpy')
+                aes.key = reference.key = self.key
+                aes.plaintext = text
+                aes.padding()
+                aes.cipher_mode(mode=mode, workers=3)
+                reference.ciphertext, reference.ctblocks = aes.ciphertext, aes.ctblocks
+                reference.invcipher_mode(mode=mode)
+                self.assertEqual(reference.plaintext, text)
+                aes.invcipher_mode(mode=mode, workers=3)
+                self.assertEqual(aes.plaintext, text)
+
+class TestProfiling(unittest.TestCase):
+
+    def test_profile(self):
+        aes = AES.new(os.urandom(16), 'CBC', engine='reference')
+        aes.plaintext = os.urandom(100)
+        aes.padding()
+        aes.keyschedule()
+        original = utils.subbytes_flat
+        with profiling.profile() as stats:
+            self.assertTrue(profiling.enabled())
+            aes.cipher_mode(mode='CBC')
+            get_key_schedule(aes.key)
+        self.assertFalse(profiling.enabled())
+        self.assertIs(utils.subbytes_flat, original)
+        self.assertEqual(stats.stages['subbytes'][0], 7 * 10)
+        self.assertEqual(stats.stages['mixcolumns'][0], 7 * 9)
+        self.assertEqual(stats.stages['xor'][0], 7)
+        self.assertEqual(stats.modes['CBC', 'encrypt']['blocks'], 7)
+        self.assertEqual(stats.cache, {'hits': 1, 'misses': 0})
+        self.assertIn('subbytes', stats.report())
+
+    def test_trace(self):
+        # FIPS-197 appendix C.1
+        key = bytes(range(16))
+        trace = dict(profiling.trace_cipher(bytes.fromhex('00112233445566778899aabbccddeeff'), key))
+        self.assertEqual(trace['round[ 1].start'], '00102030405060708090a0b0c0d0e0f0')
+        self.assertEqual(trace['round[ 1].s_box'], '63cab7040953d051cd60e0e7ba70e18c')
+        self.assertEqual(trace['round[ 1].s_row'], '6353e08c0960e104cd70b751bacad0e7')
+        self.assertEqual(trace['round[ 1].m_col'], '5f72641557f5bc92f7be3b291db9f91a')
+        self.assertEqual(trace['round[ 1].k_sch'], 'd6aa74fdd2af72fadaa678f1d6ab76fe')
+        self.assertEqual(trace['round[10].output'], '69c4e0d86a7b0430d8cdb78070b4c55a')
+        trace = dict(profiling.trace_invcipher(bytes.fromhex('69c4e0d86a7b0430d8cdb78070b4c55a'), key))
+        self.assertEqual(trace['round[ 1].is_row'], '7a9f102789d5f50b2beffd9f3dca4ea7')
+        self.assertEqual(trace['round[ 1].ik_add'], 'e9f74eec023020f61bf2ccf2353c21c7')
+        self.assertEqual(trace['round[10].ioutput'], '00112233445566778899aabbccddeeff')
+
+class TestBackends(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    def setUp(self):
+        self.addCleanup(backends.load)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.path = os.path.join(self.tmp.name, 'backends.json')
+
+    def test_thresholds(self):
+        results = [{'name': 'CTR-encrypt', 'engine': engine, 'size': size, 'seconds': seconds}
+                   for engine, size, seconds in (('ttable', 16, 1), ('numpy', 16, 2), ('ttable', 256, 3),
+                                                 ('numpy', 256, 2), ('ttable', 4096, 9), ('numpy', 4096, 4))]
+        self.assertEqual(backends.thresholds(results, 'CTR-encrypt'), [[16, 'ttable'], [None, 'numpy']])
+
+    def test_select(self):
+        with open(self.path, 'w') as fout:
+            json.dump({'version': backends.VERSION, 'choices': {'CTR-encrypt': [[256, 'ttable'], [None, 'numpy']]}}, fout)
+        backends.load(self.path)
+        self.assertEqual(backends.select('CTR', 'encrypt', 16), 'ttable')
+        self.assertEqual(backends.select('CTR', 'encrypt', 257), 'numpy')
+        self.assertEqual(backends.select('GCM', 'encrypt', 257), 'numpy')
+        with open('summer.txt', 'rb') as fin:
+            text = fin.read()
+        aes = AES.new(self.key, 'CTR')
+        aes.plaintext = text
+        aes.padding()
+        aes.cipher_mode(mode='CTR')
+        self.assertEqual(aes.engine, 'numpy')
+        aes.invcipher_mode(mode='CTR', engine='reference')
+        self.assertEqual((aes.engine, aes.plaintext), ('reference', text))
+
+    def test_calibrate(self):
+        choices = backends.calibrate(self.path, sizes=(16, 256), engines=('ttable', 'numpy'), min_time=0)
+        with open(self.path) as fin:
+            self.assertEqual(json.load(fin)['choices']['CBC-decrypt'], choices['CBC-decrypt'])
+        self.assertIn(backends.select('ECB', 'decrypt', 1 << 20), ('ttable', 'numpy'))
+
+class TestInto(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    def test_same_as_cipher_mode(self):
+        with open('summer.txt', 'rb') as fin:
+            text = fin.read()
+        for engine in ('reference', 'numpy', 'cython'):
+            for mode, header in (('CBC', 16), ('CTR', 8), ('ECB', 0)):
+                aes = AES.new(self.key, mode, engine=engine)
+                aes.plaintext = text
+                aes.padding()
+                aes.cipher_mode(mode=mode)
+                raw = AES.new(self.key, mode, engine=engine)
+                raw.iv, raw.nonce = aes.ciphertext[:16], aes.ciphertext[:8]
+                buf = bytearray(aes.plaintext_padded)
+                self.assertEqual(raw.encrypt_into(buf, buf), len(buf))
+                self.assertEqual(bytes(buf), aes.ciphertext[header:])
+                out = np.zeros(len(buf), dtype=np.uint8)
+                self.assertEqual(raw.decrypt_into(buf, out), len(buf))
+                self.assertEqual(out.tobytes(), aes.plaintext_padded)
+
+    def test_in_place(self):
+        data = os.urandom(3 * 16 + 5)
+        for engine in ('numpy', 'cython'):
+            aes = AES.new(self.key, 'CTR', engine=engine)
+            with mmap.mmap(-1, len(data)) as buf:
+                buf[:] = data
+                aes.encrypt_into(buf, buf, counter=7)
+                self.assertNotEqual(buf[:], data)
+                aes.decrypt_into(memoryview(buf), buf, counter=7)
+                self.assertEqual(buf[:], data)
+
+class TestPadding(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    def test_padding_length(self):
+        self.assertEqual(utils.padding_length(bytes(15) + b'\x01'), 1)
+        self.assertEqual(utils.padding_length(b'\x10' * 16), 16)
+        for block in (bytes(16), bytes(15) + b'\x11', bytes(14) + b'\x01\x02', b'\x03' * 14 + b'\x04\x03'):
+            with self.assertRaises(ValueError):
+                utils.padding_length(block)
+
+    def test_empty_plaintext(self):
+        for engine in ENGINES:
+            for mode in ('CBC', 'CTR', 'ECB'):
+                aes = AES.new(self.key, mode, engine=engine)
+                aes.plaintext = b''
+                aes.padding()
+                self.assertEqual(aes.plaintext_padded, b'\x10' * 16)
+                aes.cipher_mode(mode=mode)
+                aes.invcipher_mode(mode=mode)
+                self.assertEqual(aes.plaintext, b'')
+
+    def test_unsupported_mode(self):
+        aes = AES.new(self.key, 'CBC')
+        aes.plaintext = b'x'
+        aes.padding()
+        with self.assertRaisesRegex(ValueError, 'unsupported mode XYZ'):
+            aes.cipher_mode(mode='XYZ')
+        aes.cipher_mode(mode='CBC')
+        with self.assertRaisesRegex(ValueError, 'unsupported mode XYZ'):
+            aes.invcipher_mode(mode='XYZ')
+
+    def test_bad_padding(self):
+        for engine in ('reference', 'ttable', 'numpy', 'cython'):
+            for mode, header in (('CBC', 16), ('CTR', 8), ('ECB', 0)):
+                aes = AES.new(self.key, mode, engine=engine)
+                aes.plaintext = bytes(range(100))
+                aes.padding()
+                aes.cipher_mode(mode=mode)
+                aes.invcipher_mode(mode=mode)
+                self.assertEqual(aes.plaintext, bytes(range(100)))
+                ct = bytearray(aes.ciphertext)
+                ct[-17 if mode == 'CBC' else -1] ^= 0x20            # CBC: flips the last plain text byte
+                aes.ciphertext = bytes(ct)
+                aes.ctblocks = [aes.ciphertext[i:i + 16] for i in range(header, len(ct), 16)]
+                with self.assertRaises(ValueError):
+                    aes.invcipher_mode(mode=mode)
+                aes.ctblocks = aes.ctblocks[:-1] + [aes.ctblocks[-1][:5]]
+                with self.assertRaisesRegex(ValueError, 'whole number of blocks'):
+                    aes.invcipher_mode(mode=mode)
+                aes.ciphertext, aes.ctblocks = aes.ciphertext[:header], []
+                with self.assertRaisesRegex(ValueError, 'empty cipher text'):
+                    aes.invcipher_mode(mode=mode)
+
+class TestCommandLine(unittest.TestCase):
+
+    def test_crypt_file(self):
+        key = os.urandom(16)
+        with tempfile.TemporaryDirectory() as tmp:
+            enc, dec = os.path.join(tmp, 'enc'), os.path.join(tmp, 'dec')
+            for mode in ('CBC', 'CTR'):
+                crypt_file(AES.new(key, mode, engine='numpy'), 'buddha.txt', enc, batch_size=1000)
+                crypt_file(AES.new(key, mode, engine='numpy'), enc, dec, encrypt=False, batch_size=1000)
+                with open('buddha.txt', 'rb') as fin, open(dec, 'rb') as fdec:
+                    self.assertEqual(fdec.read(), fin.read())
+
+    def test_crypt_file_errors(self):
+        key = os.urandom(16)
+        with tempfile.TemporaryDirectory() as tmp:
+            enc, dec = os.path.join(tmp, 'enc'), os.path.join(tmp, 'dec')
+            crypt_file(AES.new(key, 'CBC', engine='numpy'), 'buddha.txt', enc)
+            with open(enc, 'r+b') as fout:
+                fout.truncate(os.path.getsize(enc) - 5)
+            with self.assertRaisesRegex(ValueError, 'truncated'):
+                crypt_file(AES.new(key, 'CBC', engine='numpy'), enc, dec, encrypt=False)
+            open(enc, 'wb').close()
+            with self.assertRaisesRegex(ValueError, 'empty'):
+                crypt_file(AES.new(key, 'CBC', engine='numpy'), enc, dec, encrypt=False)
+
+    def test_main(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            keyfile, enc, dec = [os.path.join(tmp, name) for name in ('key', 'enc', 'dec')]
+            with open(keyfile, 'w') as fout:
+                fout.write('2b7e151628aed2a6abf7158809cf4f3c\n')
+            self.assertEqual(main(['encrypt', '--mode', 'CTR', '--key-file', keyfile, 'summer.txt', enc]), 0)
+            self.assertEqual(main(['decrypt', '--mode', 'CTR', '--key-file', keyfile, enc, dec]), 0)
+            with open('summer.txt', 'rb') as fin, open(dec, 'rb') as fdec:
+                self.assertEqual(fdec.read(), fin.read())
+
+class TestSeekable(unittest.TestCase):
+
+    key = b'\x2b\x7e\x15\x16\x28\xae\xd2\xa6\xab\xf7\x15\x88\x09\xcf\x4f\x3c'
+
+    def setUp(self):
+        with open('buddha.txt', 'rb') as fin:
+            self.text = fin.read()
+        self.aes = AES.new(self.key, 'CTR')
+        self.aes.plaintext = self.text
+        self.aes.padding()
+        self.aes.cipher_mode(mode='CTR')
+
+    def test_decrypt_range(self):
+        for offset, length in ((0, 1), (5, 100), (16, 16), (1000, 3000), (len(self.text) - 3, 10), (len(self.text) + 5, 1)):
+            self.assertEqual(self.aes.decrypt_range(self.aes.ciphertext, offset, length), self.text[offset:offset + length])
+
+    def test_reader(self):
+        with tempfile.TemporaryFile() as fenc:
+            fenc.write(self.aes.ciphertext)
+            with self.aes.reader(fenc) as reader:
+                reader.seek(100)
+                self.assertEqual(reader.read(50), self.text[100:150])
+                reader.seek(-10, os.SEEK_END)
+                self.assertEqual(reader.read(), self.text[-10:])
+                reader.seek(0)
+                self.assertEqual(reader.read(), self.text)
+
+class TestBench(unittest.TestCase):
+
+    def test_run(self):
+        results = bench.run(sizes=[32], engines=['ttable'], modes=['CTR'], min_time=0)
+        names = {r['name'] for r in results}
+        self.assertTrue({'keyexpansion', 'cipher', 'invcipher', 'padding', 'CTR-encrypt', 'CTR-decrypt'} <= names)
+        self.assertTrue(all(r['peak_bytes'] > 0 for r in results))
+
+    def test_compare(self):
+        baseline = [bench.record('CTR-encrypt', 'numpy', 1024, 1.0, 0)]
+        self.assertEqual(bench.compare([bench.record('CTR-encrypt', 'numpy', 1024, 1.1, 0)], baseline), [])
+        self.assertEqual(len(bench.compare([bench.record('CTR-encrypt', 'numpy', 1024, 1.5, 0)], baseline)), 1)
+        self.assertEqual(bench.parse_size('1G'), 1 << 30)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,51 @@
+"""
+Block slices on a shared thread pool. NumPy and the compiled core release
+the GIL while they work on a batch, so threads run CTR, ECB and CBC
+decryption of one message side by side without the process start-up and
+copies of parallel.py; medium sized messages are where this pays off.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import BLOCKSIZE
+
+MIN_BLOCKS = 1 << 10                                        # smallest slice worth a thread (16 KiB)
+MAX_WORKERS = 32                                            # threads of the shared pool at most
+
+_pool = None
+_size = 0                                                   # threads of _pool
+_lock = threading.Lock()
+
+def pool(workers):
+    """
+    the shared executor, created once with max(workers, cpu count) threads up to MAX_WORKERS and never shut down,
+    so a caller holding it can always submit; more slices than threads queue
+    """
+    global _pool, _size
+    with _lock:
+        if _pool is None:
+            _size = min(max(workers, os.cpu_count() or 1), MAX_WORKERS)
+            _pool = ThreadPoolExecutor(_size, thread_name_prefix='aes')
+        return _pool
+
+def slices(size, workers, min_blocks=MIN_BLOCKS):
+    """
+    at most workers block aligned (lo, hi) ranges covering [0, size), none smaller than min_blocks blocks but the last
+    """
+    nblocks = -(-size // BLOCKSIZE)
+    step = max(-(-nblocks // workers), min_blocks, 1) * BLOCKSIZE
+    return [(lo, min(lo + step, size)) for lo in range(0, size, step)]
+
+def run(fn, size, workers, min_blocks=MIN_BLOCKS):
+    """
+    fn(lo, hi) for every slice of [0, size); on the pool when there is more than one
+    """
+    bounds = slices(size, workers, min_blocks)
+    if len(bounds) <= 1:
+        for lo, hi in bounds:
+            fn(lo, hi)
+        return
+    executor = pool(workers)
+    for future in [executor.submit(fn, lo, hi) for lo, hi in bounds]:
+        future.result()
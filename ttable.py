@@ -0,0 +1,91 @@
+"""
+T-table engine: SubBytes, ShiftRows and MixColumns fused into four 256-entry
+32-bit tables per direction, working on four big-endian column words per block.
+Decryption uses the equivalent inverse cipher (FIPS-197 Sec. 5.3.5).
+"""
+from utils import SBOX, ISBOX, GFP2, GFP3, GFP9, GFP11, GFP13, GFP14
+
+def _ror8(w):
+    return ((w >> 8) | (w << 24)) & 0xffffffff
+
+Te0 = [(GFP2[s] << 24) | (s << 16) | (s << 8) | GFP3[s] for s in SBOX]
+Te1 = [_ror8(w) for w in Te0]
+Te2 = [_ror8(w) for w in Te1]
+Te3 = [_ror8(w) for w in Te2]
+
+Td0 = [(GFP14[s] << 24) | (GFP9[s] << 16) | (GFP13[s] << 8) | GFP11[s] for s in ISBOX]
+Td1 = [_ror8(w) for w in Td0]
+Td2 = [_ror8(w) for w in Td1]
+Td3 = [_ror8(w) for w in Td2]
+
+def _words(block):
+    return [int.from_bytes(block[i:i + 4], 'big') for i in range(0, 16, 4)]
+
+def _invmixword(w):
+    """
+    InvMixColumns of one column word; SBOX cancels the ISBOX built into Td
+    """
+    return (Td0[SBOX[w >> 24]] ^ Td1[SBOX[(w >> 16) & 0xff]] ^
+            Td2[SBOX[(w >> 8) & 0xff]] ^ Td3[SBOX[w & 0xff]])
+
+def _enc_words(ks):
+    return [w for rk in ks.round_keys for w in _words(rk)]
+
+def _dec_words(ks):
+    """
+    round keys of the equivalent inverse cipher: reversed, InvMixColumns on the inner rounds
+    """
+    rks = [_words(rk) for rk in ks.round_keys[::-1]]
+    for r in range(1, len(rks) - 1):
+        rks[r] = [_invmixword(w) for w in rks[r]]
+    return [w for rk in rks for w in rk]
+
+def encrypt_block(block, ks):
+    """
+    block: 16 bytes of plain text
+    ks: utils.KeySchedule
+    return: 16 bytes of cipher text
+    """
+    rk = ks.derive('ttable_enc', _enc_words)
+    nr = len(rk) // 4 - 1
+    s0 = int.from_bytes(block[0:4], 'big') ^ rk[0]
+    s1 = int.from_bytes(block[4:8], 'big') ^ rk[1]
+    s2 = int.from_bytes(block[8:12], 'big') ^ rk[2]
+    s3 = int.from_bytes(block[12:16], 'big') ^ rk[3]
+    for r in range(4, 4 * nr, 4):
+        t0 = Te0[s0 >> 24] ^ Te1[(s1 >> 16) & 0xff] ^ Te2[(s2 >> 8) & 0xff] ^ Te3[s3 & 0xff] ^ rk[r]
+        t1 = Te0[s1 >> 24] ^ Te1[(s2 >> 16) & 0xff] ^ Te2[(s3 >> 8) & 0xff] ^ Te3[s0 & 0xff] ^ rk[r + 1]
+        t2 = Te0[s2 >> 24] ^ Te1[(s3 >> 16) & 0xff] ^ Te2[(s0 >> 8) & 0xff] ^ Te3[s1 & 0xff] ^ rk[r + 2]
+        t3 = Te0[s3 >> 24] ^ Te1[(s0 >> 16) & 0xff] ^ Te2[(s1 >> 8) & 0xff] ^ Te3[s2 & 0xff] ^ rk[r + 3]
+        s0, s1, s2, s3 = t0, t1, t2, t3
+    r = 4 * nr
+    t0 = (SBOX[s0 >> 24] << 24 | SBOX[(s1 >> 16) & 0xff] << 16 | SBOX[(s2 >> 8) & 0xff] << 8 | SBOX[s3 & 0xff]) ^ rk[r]
+    t1 = (SBOX[s1 >> 24] << 24 | SBOX[(s2 >> 16) & 0xff] << 16 | SBOX[(s3 >> 8) & 0xff] << 8 | SBOX[s0 & 0xff]) ^ rk[r + 1]
+    t2 = (SBOX[s2 >> 24] << 24 | SBOX[(s3 >> 16) & 0xff] << 16 | SBOX[(s0 >> 8) & 0xff] << 8 | SBOX[s1 & 0xff]) ^ rk[r + 2]
+    t3 = (SBOX[s3 >> 24] << 24 | SBOX[(s0 >> 16) & 0xff] << 16 | SBOX[(s1 >> 8) & 0xff] << 8 | SBOX[s2 & 0xff]) ^ rk[r + 3]
+    return (t0 << 96 | t1 << 64 | t2 << 32 | t3).to_bytes(16, 'big')
+
+def decrypt_block(block, ks):
+    """
+    block: 16 bytes of cipher text
+    ks: utils.KeySchedule
+    return: 16 bytes of plain text
+    """
+    rk = ks.derive('ttable_dec', _dec_words)
+    nr = len(rk) // 4 - 1
+    s0 = int.from_bytes(block[0:4], 'big') ^ rk[0]
+    s1 = int.from_bytes(block[4:8], 'big') ^ rk[1]
+    s2 = int.from_bytes(block[8:12], 'big') ^ rk[2]
+    s3 = int.from_bytes(block[12:16], 'big') ^ rk[3]
+    for r in range(4, 4 * nr, 4):
+        t0 = Td0[s0 >> 24] ^ Td1[(s3 >> 16) & 0xff] ^ Td2[(s2 >> 8) & 0xff] ^ Td3[s1 & 0xff] ^ rk[r]
+        t1 = Td0[s1 >> 24] ^ Td1[(s0 >> 16) & 0xff] ^ Td2[(s3 >> 8) & 0xff] ^ Td3[s2 & 0xff] ^ rk[r + 1]
+        t2 = Td0[s2 >> 24] ^ Td1[(s1 >> 16) & 0xff] ^ Td2[(s0 >> 8) & 0xff] ^ Td3[s3 & 0xff] ^ rk[r + 2]
+        t3 = Td0[s3 >> 24] ^ Td1[(s2 >> 16) & 0xff] ^ Td2[(s1 >> 8) & 0xff] ^ Td3[s0 & 0xff] ^ rk[r + 3]
+        s0, s1, s2, s3 = t0, t1, t2, t3
+    r = 4 * nr
+    t0 = (ISBOX[s0 >> 24] << 24 | ISBOX[(s3 >> 16) & 0xff] << 16 | ISBOX[(s2 >> 8) & 0xff] << 8 | ISBOX[s1 & 0xff]) ^ rk[r]
+    t1 = (ISBOX[s1 >> 24] << 24 | ISBOX[(s0 >> 16) & 0xff] << 16 | ISBOX[(s3 >> 8) & 0xff] << 8 | ISBOX[s2 & 0xff]) ^ rk[r + 1]
+    t2 = (ISBOX[s2 >> 24] << 24 | ISBOX[(s1 >> 16) & 0xff] << 16 | ISBOX[(s0 >> 8) & 0xff] << 8 | ISBOX[s3 & 0xff]) ^ rk[r + 2]
+    t3 = (ISBOX[s3 >> 24] << 24 | ISBOX[(s2 >> 16) & 0xff] << 16 | ISBOX[(s1 >> 8) & 0xff] << 8 | ISBOX[s0 & 0xff]) ^ rk[r + 3]
+    return (t0 << 96 | t1 << 64 | t2 << 32 | t3).to_bytes(16, 'big')
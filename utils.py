@@ -1,11 +1,18 @@
+import io
+import os
 import re
+import threading
+from operator import itemgetter
+from collections import OrderedDict
 
 import numpy as np
 
-Nk = 4
+Nk = 4                                                      # AES-128; keyexpansion() and KeySchedule derive Nk, Nr from the key
 Nb = 4
 Nr = 10
 BLOCKSIZE = 16
+KEYSIZES = {16: (4, 10), 24: (6, 12), 32: (8, 14)}          # key bytes: (Nk, Nr)
+SCHEDULE_CACHE_SIZE = 64                                    # key schedules kept by get_key_schedule()
 
 SBOX = [
     99, 124, 119, 123, 242, 107, 111, 197, 48, 1, 103, 43, 254, 215, 171, 118,
@@ -179,6 +186,17 @@ Rcon = [
 
 HEX = re.compile(rb'[a-fA-F0-9]+')
 
+SBOX_BYTES = bytes(SBOX)                                    # bytes.translate() tables
+ISBOX_BYTES = bytes(ISBOX)
+# flat state: the 16 bytes block itself, state[r][c] at index 4 * c + r
+_shiftrows = itemgetter(*[4 * ((c + r) % 4) + r for c in range(4) for r in range(4)])
+_invshiftrows = itemgetter(*[4 * ((c - r) % 4) + r for c in range(4) for r in range(4)])
+_rot1 = itemgetter(*[4 * c + (r + 1) % 4 for c in range(4) for r in range(4)])   # row r + 1 of the same column
+_rot2 = itemgetter(*[4 * c + (r + 2) % 4 for c in range(4) for r in range(4)])
+_rot3 = itemgetter(*[4 * c + (r + 3) % 4 for c in range(4) for r in range(4)])
+GFP2_BYTES, GFP3_BYTES = bytes(GFP2), bytes(GFP3)
+GFP9_BYTES, GFP11_BYTES, GFP13_BYTES, GFP14_BYTES = bytes(GFP9), bytes(GFP11), bytes(GFP13), bytes(GFP14)
+
 def block_size_is_16(block):
     """
     Bytes objects are immutable sequences of single bytes.
@@ -198,12 +216,13 @@ def block2state(block):
     return state
 
 def state2block(state):
-    block = []
-    for i in range(Nb):
-        for j in range(Nk):
-            block.append(state[j][i].to_bytes(1, 'big'))
-    block = b''.join(block)
-    return block
+    return bytes([state[j][i] for i in range(Nb) for j in range(Nk)])
+
+def xor_block(a, b):
+    """
+    a XOR b as one integer operation, len(b) >= len(a)
+    """
+    return (int.from_bytes(a, 'big') ^ int.from_bytes(b[:len(a)], 'big')).to_bytes(len(a), 'big')
 
 def addroundkey(state, key):
     """
@@ -276,8 +295,66 @@ def invmixcolumns(state):
 
     return mixed
 
+def subbytes_flat(state):
+    """
+    SubBytes on a flat state (16 bytes, column by column)
+    """
+    return state.translate(SBOX_BYTES)
+
+def invsubbytes_flat(state):
+    return state.translate(ISBOX_BYTES)
+
+def shiftrows_flat(state):
+    return bytes(_shiftrows(state))
+
+def invshiftrows_flat(state):
+    return bytes(_invshiftrows(state))
+
+def _gather(state, getter, table=None):
+    """
+    state bytes permuted by getter, then optionally looked up in a translate table, as an integer
+    """
+    state = bytes(getter(state))
+    return int.from_bytes(state.translate(table) if table else state, 'big')
+
+def mixcolumns_flat(state):
+    """
+    MixColumns on a flat state as four whole-block table lookups and XORs
+    """
+    mixed = (int.from_bytes(state.translate(GFP2_BYTES), 'big') ^ _gather(state, _rot1, GFP3_BYTES) ^
+             _gather(state, _rot2) ^ _gather(state, _rot3))
+    return mixed.to_bytes(BLOCKSIZE, 'big')
+
+def invmixcolumns_flat(state):
+    mixed = (int.from_bytes(state.translate(GFP14_BYTES), 'big') ^ _gather(state, _rot1, GFP11_BYTES) ^
+             _gather(state, _rot2, GFP13_BYTES) ^ _gather(state, _rot3, GFP9_BYTES))
+    return mixed.to_bytes(BLOCKSIZE, 'big')
+
+def cipher_flat(block, round_keys):
+    """
+    FIPS-197 CIPHER() on a flat state
+    round_keys: 16 bytes round keys w[0..3], ..., w[4 * Nr..4 * Nr + 3]
+    """
+    nr = len(round_keys) - 1
+    state = xor_block(block, round_keys[0])
+    for r in range(1, nr):
+        state = mixcolumns_flat(shiftrows_flat(subbytes_flat(state)))
+        state = xor_block(state, round_keys[r])
+    return xor_block(shiftrows_flat(subbytes_flat(state)), round_keys[nr])
+
+def invcipher_flat(block, round_keys):
+    """
+    FIPS-197 INVCIPHER() on a flat state
+    """
+    nr = len(round_keys) - 1
+    state = xor_block(block, round_keys[nr])
+    for r in range(nr - 1, 0, -1):
+        state = invsubbytes_flat(invshiftrows_flat(state))
+        state = invmixcolumns_flat(xor_block(state, round_keys[r]))
+    return xor_block(invsubbytes_flat(invshiftrows_flat(state)), round_keys[0])
+
 def subword(w):
-    f = lambda x: int(x.hex()[0], 16) * 16 + int(x.hex()[1], 16)
+    f = lambda x: x if isinstance(x, int) else int(x.hex()[0], 16) * 16 + int(x.hex()[1], 16)
     assert len(w) == 4
     return [SBOX[f(w[0])], SBOX[f(w[1])], SBOX[f(w[2])], SBOX[f(w[3])]]
 
@@ -285,31 +362,129 @@ def rotword(w):
     assert len(w) == 4
     return [w[1].to_bytes(1, 'big'), w[2].to_bytes(1, 'big'), w[3].to_bytes(1, 'big'), w[0].to_bytes(1, 'big')]
 
+def keysize(key):
+    """
+    (Nk, Nr) of a 16, 24 or 32 bytes key
+    """
+    if len(key) not in KEYSIZES:
+        raise ValueError('AES keys are 16, 24 or 32 bytes')
+    return KEYSIZES[len(key)]
+
 def keyexpansion(key):
     """
-    key: a list of 4 * Nk bytes
-    return: a list of 4 * (Nr + 1) bytes
+    key: a list of 4 * Nk bytes, Nk = 4, 6 or 8
+    return: a list of 4 * (Nr + 1) words of 4 bytes
     """
+    nk, nr = keysize(key)
     i = 0
     w = []
-    while i < Nk:
+    while i < nk:
         w.append(key[4 * i: 4 * i + 4])
         i += 1
 
-    while i <= 4 * Nr + 3:                       # Nr = 10, i = 0, 1, ..., 43
+    while i <= 4 * nr + 3:                       # AES-128: Nr = 10, i = 0, 1, ..., 43
         temp = w[i - 1]
-        if i % Nk == 0:
+        if i % nk == 0:
             temp = subword(rotword(temp))
-            temp[0] = temp[0] ^ Rcon[i // Nk]
-        elif Nk > 6 and i % Nk == 4:
+            temp[0] = temp[0] ^ Rcon[i // nk]
+        elif nk > 6 and i % nk == 4:
             temp = subword(temp)
         temp = [ord(t) if isinstance(t, bytes) else t for t in temp]
-        w.append(b''.join([(w[i - Nk][j] ^ temp[j]).to_bytes(1, 'big') for j in range(Nk)]))
+        w.append(b''.join([(w[i - nk][j] ^ temp[j]).to_bytes(1, 'big') for j in range(4)]))
         i += 1
 
-    assert len(w) == (4 * Nr + 4)
+    assert len(w) == (4 * nr + 4)
     return w
 
-def cleanup_last_block(block):
+def pkcs7_pad(data):
+    """
+    data followed by its PKCS#7 padding, 1 to 16 bytes of the padding length
+    """
+    n = BLOCKSIZE - len(data) % BLOCKSIZE
+    return bytes(data) + bytes([n]) * n
+
+def padding_length(block):
+    """
+    length of the PKCS#7 padding ending the last plain text block; ValueError unless it is 1 to 16 bytes all equal to it
+    """
     assert len(block) == BLOCKSIZE
-    return block[:(BLOCKSIZE - block[-1])]
+    n = block[-1]
+    if not 0 < n <= BLOCKSIZE or block[BLOCKSIZE - n:] != bytes([n]) * n:
+        raise ValueError('bad padding')
+    return n
+
+def cleanup_last_block(block):
+    return block[:(BLOCKSIZE - padding_length(block))]
+
+
+class KeySchedule():
+    """
+    The expanded key of one AES-128, AES-192 or AES-256 key, computed once.
+    Nk, Nr: key length in words and rounds, from len(key)
+    round_keys: Nr + 1 16 bytes round keys (flat states), w[0..3] first
+    """
+    def __init__(self, key):
+        self.key = bytes(key)
+        self.Nk, self.Nr = keysize(self.key)
+        words = keyexpansion(self.key)
+        self.round_keys = [b''.join(words[i:i + 4]) for i in range(0, len(words), 4)]
+        self.derived = {}
+
+    def derive(self, name, build):
+        """
+        Engine specific form of the round keys, built by build(self) on first use
+        """
+        value = self.derived.get(name)
+        if value is None:
+            value = self.derived[name] = build(self)
+        return value
+
+_schedules = OrderedDict()
+_schedules_lock = threading.Lock()                          # threads.py and keystream.py workers share the cache
+
+def get_key_schedule(key):
+    """
+    Return the KeySchedule of key, shared through a LRU cache of SCHEDULE_CACHE_SIZE entries
+    """
+    key = bytes(key)
+    with _schedules_lock:
+        ks = _schedules.get(key)
+        if ks is not None:
+            _schedules.move_to_end(key)
+            return ks
+    ks = KeySchedule(key)                                   # expanded outside the lock
+    with _schedules_lock:
+        ks = _schedules.setdefault(key, ks)
+        _schedules.move_to_end(key)
+        if len(_schedules) > SCHEDULE_CACHE_SIZE:
+            _schedules.popitem(last=False)
+    return ks
+
+class Source():
+    """
+    positional reads from bytes-like data, a binary file object or a path (opened here, closed by close())
+    """
+    def __init__(self, source):
+        self.file = None
+        self.owned = False
+        if isinstance(source, (str, os.PathLike)):
+            self.file = open(source, 'rb')
+            self.owned = True
+        elif hasattr(source, 'read'):
+            self.file = source
+        else:
+            self.data = memoryview(source).cast('B')
+        if self.file:
+            self.size = self.file.seek(0, io.SEEK_END)
+        else:
+            self.size = len(self.data)
+
+    def pread(self, pos, n):
+        if self.file:
+            self.file.seek(pos)
+            return self.file.read(n)
+        return bytes(self.data[pos:pos + n])
+
+    def close(self):
+        if self.owned:
+            self.file.close()
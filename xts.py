@@ -0,0 +1,141 @@
+"""
+XTS-AES (IEEE 1619) for sector based storage. Every sector is encrypted on its
+own with the tweak T = E_K2(sector number, 16 bytes little endian), multiplied
+by x (GFP2 style doubling in GF(2^128)) for each next block of the sector:
+
+    C_j = E_K1(P_j ^ T_j) ^ T_j,  T_j = T * x^j
+
+The key is K1 || K2, two AES keys of the same size. Sectors are a multiple of
+16 bytes, so there is no cipher text stealing. Sectors are independent, so
+any list of them can be read, encrypted and written back in any order, and
+encrypt_image()/decrypt_image() split them over worker processes that map
+the image file themselves.
+"""
+import os
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import batch
+from utils import BLOCKSIZE, get_key_schedule, keysize
+
+SECTOR_SIZE = 4096                                          # bytes
+CHUNK_SECTORS = 1024                                        # sectors per task handed to a worker
+ONE, TOP = np.uint64(1), np.uint64(63)
+POLY = np.uint64(0x87)                                      # x^128 = x^7 + x^2 + x + 1
+
+def split_key(key):
+    """
+    return: the key schedules of K1 (data) and K2 (tweak); IEEE 1619 requires K1 != K2
+    """
+    assert len(key) % 2 == 0
+    half = len(key) // 2
+    keysize(key[:half])
+    if key[:half] == key[half:]:
+        raise ValueError('XTS key halves must differ')
+    return get_key_schedule(bytes(key[:half])), get_key_schedule(bytes(key[half:]))
+
+def tweaks(ks2, sectors, nblocks):
+    """
+    sectors: sequence of sector numbers
+    return: (len(sectors), nblocks, 16) uint8 array of the tweak of every block
+    """
+    n = len(sectors)
+    blocks = np.zeros((n, BLOCKSIZE), dtype=np.uint8)
+    blocks[:, :8] = np.asarray(sectors, dtype='<u8').view(np.uint8).reshape(n, 8)
+    t = np.ascontiguousarray(batch.encrypt_blocks(blocks, ks2)).view('<u8')
+    lo, hi = t[:, 0].copy(), t[:, 1].copy()
+    out = np.empty((n, nblocks, 2), dtype='<u8')
+    for j in range(nblocks):                                # one doubling for every sector at once
+        out[:, j, 0], out[:, j, 1] = lo, hi
+        carry = hi >> TOP
+        hi = (hi << ONE) | (lo >> TOP)
+        lo = (lo << ONE) ^ (carry * POLY)
+    return out.view(np.uint8).reshape(n, nblocks, BLOCKSIZE)
+
+def _crypt(key, data, sectors, sector_size, encrypt):
+    assert sector_size % BLOCKSIZE == 0 and len(data) % sector_size == 0
+    ks1, ks2 = split_key(key)
+    n = len(data) // sector_size
+    if isinstance(sectors, int):
+        sectors = range(sectors, sectors + n)
+    assert len(sectors) == n
+    nblocks = sector_size // BLOCKSIZE
+    blocks = np.frombuffer(data, dtype=np.uint8).reshape(n, nblocks, BLOCKSIZE)
+    out = np.empty_like(blocks)
+    step = max(batch.BATCH_BLOCKS // nblocks, 1)
+    for i in range(0, n, step):
+        t = tweaks(ks2, sectors[i:i + step], nblocks)
+        x = (blocks[i:i + step] ^ t).reshape(-1, BLOCKSIZE)
+        x = batch.encrypt_blocks(x, ks1) if encrypt else batch.decrypt_blocks(x, ks1)
+        out[i:i + step] = x.reshape(t.shape) ^ t
+    return out
+
+def encrypt_sectors(key, data, sectors=0, sector_size=SECTOR_SIZE):
+    """
+    data: whole sectors
+    sectors: number of the first sector of data, or one sector number per sector of data
+    """
+    return _crypt(key, data, sectors, sector_size, True).tobytes()
+
+def decrypt_sectors(key, data, sectors=0, sector_size=SECTOR_SIZE):
+    return _crypt(key, data, sectors, sector_size, False).tobytes()
+
+def _image_worker(path, key, sectors, sector_size, encrypt):
+    """
+    encrypt or decrypt the given sectors of the image file in place
+    sectors: a range of step 1 (a slice of the map, no copy of the input) or a list
+    """
+    with open(path, 'r+b') as f, mmap.mmap(f.fileno(), 0) as mm:
+        image = np.frombuffer(mm, dtype=np.uint8).reshape(-1, sector_size)
+        if isinstance(sectors, range) and sectors.step == 1:
+            run = image[sectors.start:sectors.stop]
+            run[:] = _crypt(key, run.reshape(-1), sectors, sector_size, encrypt).reshape(run.shape)
+            del run
+        else:
+            idx = np.asarray(sectors, dtype=np.int64)
+            image[idx] = _crypt(key, image[idx].tobytes(), sectors, sector_size, encrypt).reshape(len(idx), sector_size)
+        del image
+        mm.flush()
+
+def crypt_image(key, path, sectors=None, encrypt=True, sector_size=SECTOR_SIZE, processes=None, chunk_sectors=CHUNK_SECTORS):
+    """
+    encrypt or decrypt sectors of an image file in place, chunk_sectors at a time on a process pool
+    sectors: sector numbers (a list or a range), every sector if None; ranges stay lazy, split into sub ranges
+    return: number of sectors processed
+    """
+    size = os.path.getsize(path)
+    assert size % sector_size == 0, 'image is not a whole number of sectors'
+    count = size // sector_size
+    if sectors is None:
+        sectors = range(count)
+    if isinstance(sectors, range):                          # no duplicates, bounds from the ends
+        if sectors and not (0 <= min(sectors[0], sectors[-1]) and max(sectors[0], sectors[-1]) < count):
+            raise ValueError('sector out of range')
+    else:
+        sectors = list(sectors)
+        if not all(0 <= s < count for s in sectors) or len(set(sectors)) != len(sectors):
+            raise ValueError('sectors out of range or repeated')
+    tasks = (sectors[i:i + chunk_sectors] for i in range(0, len(sectors), chunk_sectors))
+    key = bytes(key)
+    if len(sectors) <= chunk_sectors or processes == 1:
+        for task in tasks:
+            _image_worker(path, key, task, sector_size, encrypt)
+    else:
+        processes = processes or os.cpu_count()
+        with ProcessPoolExecutor(processes) as pool:
+            futures = []
+            for task in tasks:                              # at most 2 * processes tasks in flight
+                futures.append(pool.submit(_image_worker, path, key, task, sector_size, encrypt))
+                if len(futures) >= 2 * processes:
+                    futures.pop(0).result()
+            for future in futures:
+                future.result()
+    return len(sectors)
+
+def encrypt_image(key, path, sectors=None, **kwargs):
+    return crypt_image(key, path, sectors, True, **kwargs)
+
+def decrypt_image(key, path, sectors=None, **kwargs):
+    return crypt_image(key, path, sectors, False, **kwargs)